@@ -0,0 +1,345 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from operator import ge as operator_ge, gt as operator_gt, le as operator_le, lt as operator_lt
+from types import SimpleNamespace
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import httpx
+import numpy as np
+from openai import RateLimitError
+
+_WORDS = ["one", "two", "sky", "sea", "art", "fun", "map", "ice", "tea", "owl", "run", "jam"]
+
+def _text(tokens: int, rng: random.Random) -> str:
+    # Three-letter words plus a space are four characters, roughly one token each
+    return " ".join(rng.choice(_WORDS) for _ in range(max(tokens, 1)))
+
+def _count(text: str) -> int:
+    return len(text) // 4 + 1
+
+class FakeAsyncOpenAI:
+    """In-process stand-in for AsyncOpenAI with simulated latency, token usage and rate-limit errors."""
+
+    def __init__(self,
+                 first_token_latency: float = 0.4,
+                 per_token_latency: float = 0.02,
+                 per_input_token_latency: float = 0.0002,
+                 reply_tokens: int = 80,
+                 error_rate: float = 0.0,
+                 embedding_dimension: int = 1536,
+                 time_scale: float = 1.0,
+                 seed: int = 0):
+        self.first_token_latency = first_token_latency
+        self.per_token_latency = per_token_latency
+        self.per_input_token_latency = per_input_token_latency
+        self.reply_tokens = reply_tokens  # Length of free-text replies, capped by max_tokens
+        self.error_rate = error_rate
+        self.embedding_dimension = embedding_dimension
+        self.time_scale = time_scale  # Multiplies every simulated delay
+        self.rng = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+
+    async def _create_completion(self,
+                                 model: str,
+                                 messages: List[Dict[str, str]],
+                                 max_tokens: int,
+                                 response_format: Optional[Dict[str, str]] = None,
+                                 stream: bool = False,
+                                 **kwargs: Any):
+        self.calls["chat"] += 1
+        self._maybe_fail()
+        prompt = "\n".join(message["content"] for message in messages)
+        prompt_tokens = sum(_count(message["content"]) + 4 for message in messages)
+
+        if response_format is not None:
+            content = self._json_reply(prompt, max_tokens)
+        else:
+            content = _text(min(self.reply_tokens, max_tokens), self.rng)
+        completion_tokens = _count(content)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+        await self._sleep(self.first_token_latency + self.per_input_token_latency * prompt_tokens)
+        if stream:
+            return self._stream(content)
+        await self._sleep(self.per_token_latency * completion_tokens)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        )
+
+    async def _stream(self, content: str):
+        for word in content.split(" "):
+            await self._sleep(self.per_token_latency)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+
+    async def _create_embeddings(self, model: str, input: Any, **kwargs: Any):
+        self.calls["embeddings"] += 1
+        self._maybe_fail()
+        texts = [input] if isinstance(input, str) else list(input)
+        self.prompt_tokens += sum(_count(text) for text in texts)
+        await self._sleep(self.first_token_latency / 4)
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=embed_text(text, self.embedding_dimension))
+            for i, text in enumerate(texts)
+        ])
+
+    def _json_reply(self, prompt: str, max_tokens: int) -> str:
+        if '"rankings"' in prompt:
+            user_ids = re.findall(r'"user_id": "([^"]+)"', prompt)
+            return json.dumps({"rankings": [{
+                "user_id": user_id,
+                "score": round(self.rng.random(), 2),
+                "reason": _text(20, self.rng)
+            } for user_id in dict.fromkeys(user_ids)]})
+        if '"conversation"' in prompt:
+            turns = max((max_tokens - 300) // self.reply_tokens, 2)
+            return json.dumps({
+                "conversation": [{"speaker": 1 + i % 2, "content": _text(self.reply_tokens, self.rng)}
+                                 for i in range(turns)],
+                "summary": _text(120, self.rng)
+            })
+        return json.dumps({"result": _text(40, self.rng)})
+
+    def _maybe_fail(self) -> None:
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.calls["errors"] += 1
+            request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+            raise RateLimitError("Simulated rate limit", response=httpx.Response(429, request=request), body=None)
+
+    async def _sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds * self.time_scale)
+
+def embed_text(text: str, dimension: int = 1536) -> List[float]:
+    """Deterministic pseudo-embedding so identical texts get identical vectors."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dimension).astype(np.float32).tolist()
+
+# Primary key per table, used to resolve upserts
+_PRIMARY_KEYS = {"user_profiles": "user_id"}
+# Columns the schema's default and update trigger set on every write
+_UPDATED_AT = {"user_profiles": "updated_at"}
+
+class FakePostgrestTransport(httpx.AsyncBaseTransport):
+    """In-memory PostgREST for the subset of queries SupabaseService issues, with simulated latency."""
+
+    def __init__(self,
+                 tables: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                 latency: float = 0.01,
+                 per_row_latency: float = 0.00002,
+                 error_rate: float = 0.0,
+                 time_scale: float = 1.0,
+                 seed: int = 0):
+        self.tables = tables if tables is not None else {}
+        self.latency = latency  # Round trip per request
+        self.per_row_latency = per_row_latency  # Added per row scanned, so unfiltered scans cost more
+        self.error_rate = error_rate
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+        self.calls: Counter = Counter()  # "<METHOD> <table>" -> requests
+        self._ids = itertools.count(1 + max((row.get("id") or 0 for rows in self.tables.values() for row in rows), default=0))
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        table = request.url.path.rsplit("/", 1)[-1]
+        self.calls[f"{request.method} {table}"] += 1
+        rows = self.tables.setdefault(table, [])
+        await asyncio.sleep((self.latency + self.per_row_latency * len(rows)) * self.time_scale)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.calls["errors"] += 1
+            return httpx.Response(503, json={"message": "Simulated outage", "code": "503"})
+
+        if request.method == "GET":
+            return httpx.Response(200, json=self._select(rows, request))
+        if request.method == "POST":
+            return httpx.Response(201, json=self._insert(table, rows, request))
+        return httpx.Response(405, json={"message": f"{request.method} not supported"})
+
+    def _select(self, rows: List[Dict[str, Any]], request: httpx.Request) -> List[Dict[str, Any]]:
+        select, order, limit, offset = "*", None, None, 0
+        filters = []
+        for key, value in parse_qsl(request.url.query.decode(), keep_blank_values=True):
+            if key == "select":
+                select = value
+            elif key == "order":
+                order = value
+            elif key == "limit":
+                limit = int(value)
+            elif key == "offset":
+                offset = int(value)
+            elif key == "or":
+                alternatives = [_predicate(*condition.split(".", 2)) for condition in _split(value[1:-1])]
+                filters.append(lambda row, alternatives=alternatives: any(check(row) for check in alternatives))
+            else:
+                filters.append(_predicate(key, *value.split(".", 1)))
+
+        result = [row for row in rows if all(check(row) for check in filters)]
+        if order:
+            for term in reversed(order.split(",")):
+                column, *modifiers = term.split(".")
+                result.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse="desc" in modifiers)
+        if "Range" in request.headers:
+            start, end = map(int, request.headers["Range"].split("-"))
+            offset, limit = start, end - start + 1
+        result = result[offset:offset + limit if limit is not None else None]
+        return [_project(row, select) for row in result]
+
+    def _insert(self, table: str, rows: List[Dict[str, Any]], request: httpx.Request) -> List[Dict[str, Any]]:
+        payload = json.loads(request.content)
+        new_rows = payload if isinstance(payload, list) else [payload]
+        now = datetime.now(timezone.utc).isoformat()
+        key = _PRIMARY_KEYS.get(table, "id")
+        upsert = "resolution=merge-duplicates" in request.headers.get("Prefer", "")
+        inserted = []
+        for new_row in new_rows:
+            row = {column: now if value == "now()" else value for column, value in new_row.items()}
+            if table in _UPDATED_AT:
+                row[_UPDATED_AT[table]] = now
+            if key == "id" and row.get("id") is None:
+                row["id"] = next(self._ids)
+            existing = next((r for r in rows if r.get(key) == row[key]), None) if upsert else None
+            if existing is not None:
+                existing.update(row)
+            else:
+                rows.append(row)
+            inserted.append(row)
+        return inserted
+
+def _split(expression: str) -> List[str]:
+    # Split on commas outside parentheses and quotes
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in expression:
+        if char == '"':
+            quoted = not quoted
+        elif char == "(" and not quoted:
+            depth += 1
+        elif char == ")" and not quoted:
+            depth -= 1
+        if char == "," and depth == 0 and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    return parts + [current] if current else parts
+
+def _lookup(row: Dict[str, Any], column: str) -> Any:
+    # Follows JSON paths such as profile_data->groups
+    if "->" not in column:
+        return row.get(column)
+    value = row
+    for part in re.split(r"->>?", column):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+def _predicate(column: str, operator: str, criteria: str):
+    """Compile one PostgREST filter into a row predicate."""
+    if operator == "not":
+        negated = _predicate(column, *criteria.split(".", 1))
+        return lambda row: not negated(row)
+    if operator == "is":
+        return lambda row: _text_value(_lookup(row, column)).lower() == criteria
+    if operator == "in":
+        allowed = {item.strip('"') for item in _split(criteria[1:-1])}
+        return lambda row: _text_value(_lookup(row, column)) in allowed
+    if operator == "cs":
+        wanted = json.loads(criteria) if criteria.startswith("[") else _split(criteria[1:-1])
+        return lambda row: isinstance(_lookup(row, column), list) and all(
+            item in _lookup(row, column) for item in wanted
+        )
+    if operator == "eq":
+        return lambda row: _text_value(_lookup(row, column)) == criteria
+    if operator == "neq":
+        return lambda row: _text_value(_lookup(row, column)) != criteria
+    if operator in ("gt", "gte", "lt", "lte"):
+        compare = {"gt": operator_gt, "gte": operator_ge, "lt": operator_lt, "lte": operator_le}[operator]
+        return lambda row: _lookup(row, column) is not None and compare(_comparable(_lookup(row, column)), _comparable(criteria))
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+def _comparable(value: Any) -> Any:
+    # Numeric columns compare as numbers, everything else (ids, ISO timestamps) as text
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return str(value)
+
+def _text_value(value: Any) -> str:
+    return "null" if value is None else str(value)
+
+def _project(row: Dict[str, Any], select: str) -> Dict[str, Any]:
+    if select == "*":
+        return dict(row)
+    projected = {}
+    for column in (column.strip() for column in select.split(",")):
+        alias, _, path = column.rpartition(":")
+        projected[alias or re.split(r"->>?", path)[-1]] = _lookup(row, path)
+    return projected
+
+def make_dataset(users: int = 1000,
+                 groups: int = 20,
+                 interaction_types: Tuple[str, ...] = ("friendship", "networking", "dating"),
+                 conversations_per_user: int = 5,
+                 interactions_per_user: int = 3,
+                 embedding_dimension: int = 1536,
+                 seed: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    """Generate user_profiles, conversations and interactions rows for FakePostgrestTransport."""
+    rng = random.Random(seed)
+    user_ids = [f"user-{i}" for i in range(users)]
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    profiles = []
+    for user_id in user_ids:
+        description = f"{user_id} " + _text(60, rng)
+        profiles.append({
+            "user_id": user_id,
+            "profile_data": {
+                "description": description,
+                "interests": rng.sample(_WORDS, 3),
+                "groups": [f"group-{g}" for g in rng.sample(range(groups), min(groups, rng.randint(1, 3)))],
+                "description_embedding": embed_text(description, embedding_dimension)
+            },
+            "updated_at": start.isoformat()
+        })
+
+    conversations, interactions = [], []
+    for user_id in user_ids:
+        for _ in range(conversations_per_user):
+            timestamp = (start + timedelta(minutes=rng.randrange(500000))).isoformat()
+            conversations.append({
+                "id": len(conversations) + 1,
+                "user_id": user_id,
+                "other_user_id": rng.choice(user_ids),
+                "messages": [{"role": role, "content": _text(30, rng)} for role in ("user", "assistant") * 3],
+                "summary": _text(40, rng),
+                "timestamp": timestamp
+            })
+        for _ in range(interactions_per_user):
+            summary = _text(40, rng)
+            interactions.append({
+                "id": len(interactions) + 1,
+                "user1_id": user_id,
+                "user2_id": rng.choice(user_ids),
+                "interaction_type": rng.choice(interaction_types),
+                "conversation": [{"speaker": 1 + i % 2, "content": _text(30, rng)} for i in range(4)],
+                "summary": summary,
+                "embedding": embed_text(summary, embedding_dimension),
+                "group_id": None,
+                "timestamp": (start + timedelta(minutes=rng.randrange(500000))).isoformat()
+            })
+    return {
+        "user_profiles": profiles,
+        "conversations": conversations,
+        "interactions": interactions,
+        "friend_recommendations": []
+    }
@@ -0,0 +1,186 @@
+"""End-to-end load benchmark of the API endpoints against in-process OpenAI and Supabase stand-ins.
+
+Requests go through the real FastAPI app and services; only the AsyncOpenAI client and the
+PostgREST HTTP transport are replaced, so caching, batching and pooling are all exercised.
+
+Usage: python -m benchmarks.load [--scenario all] [--requests 200] [--concurrency 20] [--users 1000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import httpx
+import numpy as np
+
+# main builds its default services at import time, so give them harmless settings first
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_URL", "http://supabase.benchmark")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+
+import main
+from services.openai_service import OpenAIService
+from services.supabase_service import SupabaseService
+from services.postgrest_client import PooledPostgrestClient
+from services.user_interaction import UserInteractionService
+from services.friend_recommendation import FriendRecommendationService
+from services.matching_service import MatchingService
+from services.recommendation_worker import RecommendationPrecomputeWorker
+from services.metrics import instrument, instrument_token_usage
+from services.single_flight import SingleFlight
+from benchmarks.fakes import FakeAsyncOpenAI, FakePostgrestTransport, make_dataset, _text
+
+INTERACTION_TYPES = ("friendship", "networking", "dating")
+
+# Each scenario turns (rng, user_ids, args) into (method, path, json body)
+Request = Tuple[str, str, Any]
+
+def chat_request(rng: random.Random, user_ids: List[str], args: argparse.Namespace) -> Request:
+    sender, receiver = rng.sample(user_ids, 2)
+    return "POST", "/chat", {"content": _text(20, rng), "sender_id": sender, "receiver_id": receiver}
+
+def recommendations_request(rng: random.Random, user_ids: List[str], args: argparse.Namespace) -> Request:
+    return "GET", f"/users/{rng.choice(user_ids)}/recommendations", None
+
+def matchmaking_request(rng: random.Random, user_ids: List[str], args: argparse.Namespace) -> Request:
+    return "POST", "/matchmaking/request", {
+        "user_id": rng.choice(user_ids),
+        "interaction_type": rng.choice(INTERACTION_TYPES),
+        "description": _text(20, rng),
+        "preferences": [],
+        "use_embeddings": args.use_embeddings,
+        "pipeline": args.pipeline,
+        "retrieval_size": args.retrieval_size,
+        "shortlist_size": args.shortlist_size
+    }
+
+def friends_request(rng: random.Random, user_ids: List[str], args: argparse.Namespace) -> Request:
+    return "GET", f"/users/{rng.choice(user_ids)}/friends", None
+
+SCENARIOS: Dict[str, Callable[[random.Random, List[str], argparse.Namespace], Request]] = {
+    "chat": chat_request,
+    "recommendations": recommendations_request,
+    "matchmaking": matchmaking_request,
+    "friends": friends_request
+}
+
+def install_services(args: argparse.Namespace) -> Tuple[FakeAsyncOpenAI, FakePostgrestTransport]:
+    """Point main's module-level services at fresh instances backed by the fakes."""
+    openai_client = FakeAsyncOpenAI(
+        first_token_latency=args.model_latency,
+        reply_tokens=args.reply_tokens,
+        error_rate=args.openai_error_rate,
+        embedding_dimension=args.dimension,
+        time_scale=args.time_scale,
+        seed=args.seed
+    )
+    transport = FakePostgrestTransport(
+        make_dataset(users=args.users, groups=args.groups, interaction_types=INTERACTION_TYPES,
+                     embedding_dimension=args.dimension, seed=args.seed),
+        latency=args.db_latency,
+        error_rate=args.db_error_rate,
+        time_scale=args.time_scale,
+        seed=args.seed
+    )
+    main.openai_service = OpenAIService(client=openai_client)
+    main.openai_service.scheduler.base_delay *= args.time_scale  # Backoff runs on the simulated clock too
+    main.supabase_service = SupabaseService(
+        client=PooledPostgrestClient("http://supabase.benchmark", "benchmark", transport=transport)
+    )
+    main.user_interaction_service = UserInteractionService(main.openai_service, main.supabase_service)
+    main.friend_recommendation_service = FriendRecommendationService(main.openai_service, main.supabase_service)
+    main.matching_service = MatchingService(main.openai_service, main.supabase_service)
+    main.recommendation_worker = RecommendationPrecomputeWorker(
+        main.friend_recommendation_service, main.supabase_service, refresh_interval=0, concurrency=0
+    )
+    main.coalescer = SingleFlight(retention=main.coalescer.retention)
+    main.supabase_service.profile_listeners.append(
+        lambda user_id: main.coalescer.forget(("recommendations", user_id))
+    )
+    if main.metrics is not None:  # METRICS_ENABLED=true measures the instrumentation overhead too
+        instrument(main.openai_service, "openai", main.metrics)
+        instrument(main.supabase_service, "supabase", main.metrics)
+        instrument_token_usage(main.openai_service.tokens, main.metrics)
+    return openai_client, transport
+
+async def run_scenario(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    openai_client, transport = install_services(args)
+    await main.load_indexes()
+    openai_before = sum(openai_client.calls[kind] for kind in ("chat", "embeddings"))
+    db_before = sum(count for key, count in transport.calls.items() if key != "errors")
+    tokens_before = openai_client.prompt_tokens + openai_client.completion_tokens
+
+    rng = random.Random(args.seed)
+    active_users = [f"user-{i}" for i in range(min(args.active_users, args.users))]
+    requests = [SCENARIOS[name](rng, active_users, args) for _ in range(args.requests)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app),
+                                 base_url="http://benchmark", timeout=None) as client:
+        async def send(method: str, path: str, body: Any) -> None:
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.request(method, path, json=body)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(*request) for request in requests))
+        elapsed = time.perf_counter() - start
+
+    openai_calls = sum(openai_client.calls[kind] for kind in ("chat", "embeddings")) - openai_before
+    db_calls = sum(count for key, count in transport.calls.items() if key != "errors") - db_before
+    tokens = openai_client.prompt_tokens + openai_client.completion_tokens - tokens_before
+    await main.drain_background_work()
+    return {
+        "scenario": name,
+        "requests": args.requests,
+        "errors": errors,
+        "throughput": args.requests / elapsed,
+        "p50": float(np.percentile(latencies, 50)) * 1000,
+        "p99": float(np.percentile(latencies, 99)) * 1000,
+        "openai_calls": openai_calls / args.requests,
+        "db_calls": db_calls / args.requests,
+        "tokens": tokens / args.requests
+    }
+
+async def main_async() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=1000, help="Profiles in the fake database")
+    parser.add_argument("--active-users", type=int, default=100, help="Users that requests are drawn from")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--dimension", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--model-latency", type=float, default=0.4, help="Seconds to first model token")
+    parser.add_argument("--reply-tokens", type=int, default=80)
+    parser.add_argument("--db-latency", type=float, default=0.01, help="Seconds per database round trip")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--use-embeddings", action="store_true", help="Use embedding matchmaking")
+    parser.add_argument("--pipeline", action="store_true", help="Use retrieve-then-rerank matchmaking")
+    parser.add_argument("--retrieval-size", type=int, default=None, help="Pipeline stage-1 candidates")
+    parser.add_argument("--shortlist-size", type=int, default=None, help="Pipeline stage-2 candidates")
+    parser.add_argument("--time-scale", type=float, default=0.05,
+                        help="Fraction of the simulated model and database latency actually slept")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    print(f"{'scenario':<17}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'openai/req':>12}{'db/req':>8}{'tokens/req':>12}")
+    for name in names:
+        r = await run_scenario(name, args)
+        print(f"{r['scenario']:<17}{r['requests']:>9}{r['errors']:>8}{r['throughput']:>9.1f}{r['p50']:>9.1f}"
+              f"{r['p99']:>9.1f}{r['openai_calls']:>12.2f}{r['db_calls']:>8.2f}{r['tokens']:>12.0f}")
+    print(f"Latency and throughput are wall-clock with upstream delays scaled by {args.time_scale}.")
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
@@ -0,0 +1,50 @@
+"""Compare turn-by-turn and single-shot match simulations against a simulated model.
+
+Usage: python -m benchmarks.simulation_modes [--pairs 5] [--max-tokens 2000] [--time-scale 0.05]
+"""
+import argparse
+import asyncio
+import time
+
+from services.openai_service import OpenAIService, SIMULATION_MODES
+from benchmarks.fakes import FakeAsyncOpenAI
+
+async def run_mode(mode: str, pairs: int, max_tokens: int, time_scale: float) -> dict:
+    client = FakeAsyncOpenAI(time_scale=time_scale)
+    service = OpenAIService(client=client)
+    latencies = []
+    for i in range(pairs):
+        start = time.perf_counter()
+        await service.simulate_model_interaction(
+            f"Person {i} who enjoys hiking and jazz",
+            f"Person {i + pairs} who enjoys cooking and chess",
+            "networking",
+            max_tokens=max_tokens,
+            mode=mode
+        )
+        latencies.append((time.perf_counter() - start) / time_scale)
+    return {
+        "mode": mode,
+        "requests": client.calls["chat"] / pairs,
+        "prompt_tokens": client.prompt_tokens / pairs,
+        "completion_tokens": client.completion_tokens / pairs,
+        "latency": sum(latencies) / pairs
+    }
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=2000)
+    parser.add_argument("--time-scale", type=float, default=0.05,
+                        help="Fraction of the simulated model latency actually slept")
+    args = parser.parse_args()
+
+    print(f"{'mode':<14}{'requests':>10}{'prompt tok':>12}{'output tok':>12}{'latency s':>11}")
+    for mode in SIMULATION_MODES:
+        result = await run_mode(mode, args.pairs, args.max_tokens, args.time_scale)
+        print(f"{result['mode']:<14}{result['requests']:>10.1f}{result['prompt_tokens']:>12.0f}"
+              f"{result['completion_tokens']:>12.0f}{result['latency']:>11.2f}")
+    print("Values are per simulation; latency is scaled back to simulated model time.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,7 +1,10 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
+import json
+import logging
 import os
 from dotenv import load_dotenv
 
@@ -10,9 +13,14 @@ from services.supabase_service import SupabaseService
 from services.user_interaction import UserInteractionService
 from services.friend_recommendation import FriendRecommendationService
 from services.matching_service import MatchingService
+from services.recommendation_worker import RecommendationPrecomputeWorker
+from services.single_flight import SingleFlight
+from services.metrics import Metrics, MetricsMiddleware, instrument, instrument_token_usage
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
 # Configure CORS
@@ -30,6 +38,86 @@ supabase_service = SupabaseService()
 user_interaction_service = UserInteractionService(openai_service, supabase_service)
 friend_recommendation_service = FriendRecommendationService(openai_service, supabase_service)
 matching_service = MatchingService(openai_service, supabase_service)
+recommendation_worker = RecommendationPrecomputeWorker(
+    friend_recommendation_service,
+    supabase_service,
+    refresh_interval=float(os.getenv("RECOMMENDATION_REFRESH_INTERVAL", "3600")),
+    concurrency=int(os.getenv("RECOMMENDATION_WORKERS", "2"))
+)
+
+# Identical matchmaking and recommendation requests share one computation
+coalescer = SingleFlight(retention=float(os.getenv("COALESCE_RETENTION_SECONDS", "0")))
+supabase_service.profile_listeners.append(lambda user_id: coalescer.forget(("recommendations", user_id)))
+
+# Instrumentation is opt-in; when disabled nothing is wrapped and no middleware runs
+metrics = Metrics() if os.getenv("METRICS_ENABLED", "false").lower() == "true" else None
+if metrics is not None:
+    instrument(openai_service, "openai", metrics)
+    instrument(supabase_service, "supabase", metrics)
+    instrument_token_usage(openai_service.tokens, metrics)
+    metrics.register_callback(
+        "llm_cache_lookups_total", "counter", "Model response cache lookups by call type and result",
+        lambda: [({"call_type": call_type, "result": "hit"}, count)
+                 for call_type, count in openai_service.cache.hits.items()]
+              + [({"call_type": call_type, "result": "miss"}, count)
+                 for call_type, count in openai_service.cache.misses.items()]
+    )
+    metrics.register_callback(
+        "profile_cache_lookups_total", "counter", "Profile cache lookups by result",
+        lambda: [({"result": "hit"}, supabase_service.profile_cache.hits),
+                 ({"result": "miss"}, supabase_service.profile_cache.misses)]
+    )
+    metrics.register_callback(
+        "openai_queue_depth", "gauge", "OpenAI requests waiting for rate-limit capacity by priority",
+        lambda: [({"priority": priority}, depth)
+                 for priority, depth in openai_service.scheduler.queue_depth().items()]
+    )
+    metrics.register_callback(
+        "openai_retries_total", "counter", "OpenAI requests retried by reason and outcome",
+        lambda: [({"reason": reason, "outcome": "retried"}, count)
+                 for reason, count in openai_service.scheduler.retries.items()]
+              + [({"reason": reason, "outcome": "failed"}, count)
+                 for reason, count in openai_service.scheduler.failures.items()]
+    )
+    metrics.register_callback(
+        "coalesced_requests_total", "counter", "Requests that ran their own computation or shared another's",
+        lambda: [({"outcome": "computed"}, coalescer.started), ({"outcome": "shared"}, coalescer.shared)]
+    )
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+@app.on_event("startup")
+async def load_indexes():
+    try:
+        await supabase_service.load_profile_index()
+    except Exception as e:
+        # Serving continues with an index that fills up as profiles are updated
+        logger.warning("Failed to load profile embedding index: %s", e)
+    try:
+        await supabase_service.load_interaction_index()
+    except Exception as e:
+        logger.warning("Failed to load interaction index: %s", e)
+    try:
+        await supabase_service.load_interaction_graph()
+    except Exception as e:
+        # Partners saved from now on are still excluded; earlier ones may be suggested again
+        logger.warning("Failed to load interaction graph: %s", e)
+
+@app.on_event("startup")
+async def start_background_workers():
+    recommendation_worker.start()
+    supabase_service.start_snapshots()
+
+@app.on_event("shutdown")
+async def drain_background_work():
+    await recommendation_worker.stop()
+    await user_interaction_service.drain()
+    await supabase_service.close()
+
+@app.get("/metrics")
+async def get_metrics():
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 class UserProfile(BaseModel):
     user_id: str
@@ -48,6 +136,10 @@ class InteractionRequest(BaseModel):
     preferences: List[str]
     target_group_id: Optional[str] = None
     use_embeddings: bool = False
+    concurrent: bool = True
+    pipeline: Optional[bool] = None  # Retrieve-then-rerank; defaults to MATCHING_PIPELINE
+    retrieval_size: Optional[int] = Field(None, ge=1)  # Stage-1 candidates, defaults to MATCHING_RETRIEVAL_SIZE
+    shortlist_size: Optional[int] = Field(None, ge=1)  # Stage-2 candidates, defaults to MATCHING_SHORTLIST_SIZE
 
 @app.post("/users/{user_id}/profile")
 async def update_user_profile(user_id: str, profile: UserProfile):
@@ -68,23 +160,55 @@ async def get_user_profile(user_id: str):
 @app.post("/chat")
 async def send_message(message: ChatMessage):
     try:
-        response = await user_interaction_service.process_message(message)
+        response = await user_interaction_service.process_message(message.dict())
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def stream_message(message: ChatMessage):
+    async def events():
+        try:
+            async for event in user_interaction_service.stream_message(message.dict()):
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def _split_fields(fields: Optional[str]) -> Optional[List[str]]:
+    return [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+
 @app.get("/users/{user_id}/friends")
-async def get_friends(user_id: str):
+async def get_friends(
+    user_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
     try:
-        friends = await supabase_service.get_user_friends(user_id)
+        friends, next_cursor = await supabase_service.get_user_friends(
+            user_id,
+            limit,
+            cursor,
+            _split_fields(fields)
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return friends
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/users/{user_id}/recommendations")
 async def get_friend_recommendations(user_id: str):
     try:
-        recommendations = await friend_recommendation_service.get_recommendations(user_id)
+        recommendations = await coalescer.run(
+            ("recommendations", user_id),
+            lambda: friend_recommendation_service.get_recommendations(user_id)
+        )
         return recommendations
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -92,28 +216,65 @@ async def get_friend_recommendations(user_id: str):
 @app.post("/matchmaking/request")
 async def request_match(request: InteractionRequest):
     try:
-        matches = await matching_service.find_matches(
-            request.user_id,
-            request.interaction_type,
-            request.use_embeddings,
-            request.target_group_id
+        matches = await coalescer.run(
+            ("matches", request.user_id, request.interaction_type, request.target_group_id, request.use_embeddings,
+             request.pipeline, request.retrieval_size, request.shortlist_size),
+            lambda: matching_service.find_matches(
+                request.user_id,
+                request.interaction_type,
+                request.use_embeddings,
+                request.target_group_id,
+                request.concurrent,
+                request.pipeline,
+                request.retrieval_size,
+                request.shortlist_size
+            )
         )
         return matches
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/matchmaking/stream")
+async def stream_matches(request: InteractionRequest):
+    async def frames():
+        try:
+            async for frame in matching_service.stream_matches(
+                request.user_id,
+                request.interaction_type,
+                request.use_embeddings,
+                request.target_group_id,
+                request.concurrent,
+                request.pipeline,
+                request.retrieval_size,
+                request.shortlist_size
+            ):
+                yield json.dumps(frame) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
+
 @app.get("/matchmaking/embeddings/{user_id}")
 async def get_embedding_matches(
     user_id: str,
     interaction_type: str,
-    group_id: Optional[str] = None
+    group_id: Optional[str] = None,
+    pipeline: Optional[bool] = None,
+    retrieval_size: Optional[int] = Query(None, ge=1),
+    shortlist_size: Optional[int] = Query(None, ge=1)
 ):
     try:
-        matches = await matching_service.find_matches(
-            user_id,
-            interaction_type,
-            use_embeddings=True,
-            group_id=group_id
+        matches = await coalescer.run(
+            ("matches", user_id, interaction_type, group_id, True, pipeline, retrieval_size, shortlist_size),
+            lambda: matching_service.find_matches(
+                user_id,
+                interaction_type,
+                use_embeddings=True,
+                group_id=group_id,
+                pipeline=pipeline,
+                retrieval_size=retrieval_size,
+                shortlist_size=shortlist_size
+            )
         )
         return matches
     except Exception as e:
@@ -122,16 +283,27 @@ async def get_embedding_matches(
 @app.get("/users/{user_id}/interactions")
 async def get_user_interactions(
     user_id: str,
+    response: Response,
     interaction_type: Optional[str] = None,
-    group_id: Optional[str] = None
+    group_id: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     try:
-        interactions = await supabase_service.get_user_interactions(
+        interactions, next_cursor = await supabase_service.get_user_interactions(
             user_id,
             interaction_type,
-            group_id
+            group_id,
+            limit,
+            cursor,
+            _split_fields(fields)
         )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return interactions
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,134 @@
+from typing import List, Dict, Any, Optional, Iterable, Set, Tuple
+import numpy as np
+
+ANY_INTERACTION_TYPE = "*"  # Term for users who have not restricted their interaction types
+
+Term = Tuple[str, str]  # ("group", group_id), ("type", interaction_type) or ("all", "")
+_ALL: Term = ("all", "")
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+class CandidateIndex:
+    """Inverted index from group_id and interaction_type to member users, as sorted int32 id arrays.
+
+    Updates are buffered per term and merged into the sorted array the next time that term is
+    queried, so a bulk load or a burst of profile updates costs one sort per term rather than one
+    array copy per change.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self._ids: Dict[str, int] = {}
+        self._user_ids: List[str] = []  # int id -> user_id; ids are never reused
+        self._terms: Dict[int, frozenset] = {}  # int id -> the terms the user is listed under
+        self._postings: Dict[Term, np.ndarray] = {}
+        self._added: Dict[Term, Set[int]] = {}
+        self._removed: Dict[Term, Set[int]] = {}
+        self._open_to: Dict[str, np.ndarray] = {}  # interaction_type -> union with the ANY posting
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def __contains__(self, user_id: str) -> bool:
+        return self._ids.get(user_id) in self._terms
+
+    def upsert_profile(self, user_id: str, profile_data: Dict[str, Any]) -> None:
+        """Index a user under their groups and interaction types (all types if none are set)."""
+        self.upsert(
+            user_id,
+            profile_data.get("groups") or [],
+            profile_data.get("interaction_types") or [ANY_INTERACTION_TYPE]
+        )
+
+    def upsert(self, user_id: str, groups: Iterable[str], interaction_types: Iterable[str]) -> None:
+        uid = self._ids.get(user_id)
+        if uid is None:
+            uid = self._ids[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+        terms = frozenset([_ALL, *(("group", g) for g in groups), *(("type", t) for t in interaction_types)])
+        previous = self._terms.get(uid, frozenset())
+        for term in previous - terms:
+            self._remove(term, uid)
+        for term in terms - previous:
+            self._add(term, uid)
+        self._terms[uid] = terms
+
+    def delete(self, user_id: str) -> None:
+        uid = self._ids.get(user_id)
+        for term in self._terms.pop(uid, frozenset()):
+            self._remove(term, uid)
+
+    def members(self, group_id: Optional[str] = None, interaction_type: Optional[str] = None) -> np.ndarray:
+        """Sorted int ids of users in the group and open to the interaction type (either may be None)."""
+        postings = []
+        if group_id is not None:
+            postings.append(self._posting(("group", group_id)))
+        if interaction_type is not None:
+            postings.append(self._open_to_type(interaction_type))
+        if not postings:
+            return self._posting(_ALL)
+        postings.sort(key=len)  # Probe the larger postings with the smallest
+        members = postings[0]
+        for posting in postings[1:]:
+            if not len(members) or not len(posting):
+                return _EMPTY
+            positions = np.minimum(np.searchsorted(posting, members), len(posting) - 1)
+            members = members[posting[positions] == members]
+        return members
+
+    def candidates(self,
+                   group_id: Optional[str] = None,
+                   interaction_type: Optional[str] = None,
+                   exclude_ids: Iterable[str] = (),
+                   limit: Optional[int] = None) -> List[str]:
+        """User ids matching the filters minus exclude_ids, randomly sampled down to limit."""
+        members = self.members(group_id, interaction_type)
+        excluded = {self._ids[user_id] for user_id in exclude_ids if user_id in self._ids}
+        if limit is not None and len(members) > limit + len(excluded):
+            # Oversample by the exclusions so filtering them out still leaves limit ids
+            members = self._rng.choice(members, size=limit + len(excluded), replace=False)
+        user_ids = [self._user_ids[uid] for uid in members.tolist() if uid not in excluded]
+        return user_ids if limit is None else user_ids[:limit]
+
+    def _add(self, term: Term, uid: int) -> None:
+        self._removed.get(term, set()).discard(uid)
+        self._added.setdefault(term, set()).add(uid)
+        self._invalidate(term)
+
+    def _remove(self, term: Term, uid: int) -> None:
+        self._added.get(term, set()).discard(uid)
+        self._removed.setdefault(term, set()).add(uid)
+        self._invalidate(term)
+
+    def _invalidate(self, term: Term) -> None:
+        if term[0] != "type":
+            return
+        if term[1] == ANY_INTERACTION_TYPE:
+            self._open_to.clear()
+        else:
+            self._open_to.pop(term[1], None)
+
+    def _open_to_type(self, interaction_type: str) -> np.ndarray:
+        """Users listing the interaction type or not restricting types at all."""
+        posting = self._open_to.get(interaction_type)
+        if posting is None:
+            posting = self._open_to[interaction_type] = np.union1d(
+                self._posting(("type", interaction_type)),
+                self._posting(("type", ANY_INTERACTION_TYPE))
+            )
+        return posting
+
+    def _posting(self, term: Term) -> np.ndarray:
+        posting = self._postings.get(term, _EMPTY)
+        added = self._added.pop(term, None)
+        removed = self._removed.pop(term, None)
+        if added:
+            posting = np.union1d(posting, np.fromiter(added, dtype=np.int32, count=len(added)))
+        if removed:
+            posting = np.setdiff1d(posting, np.fromiter(removed, dtype=np.int32, count=len(removed)),
+                                   assume_unique=True)
+        if added or removed:
+            if len(posting):
+                self._postings[term] = posting
+            else:
+                self._postings.pop(term, None)
+        return posting
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Callable, Set
+from .openai_service import OpenAIService
+from .supabase_service import SupabaseService
+
+logger = logging.getLogger(__name__)
+
+class ConversationSession:
+    """Active message window and rolling summary for one pair of users."""
+
+    def __init__(self, user_id: str, other_user_id: str, messages: List[Dict[str, str]]):
+        self.user_id = user_id
+        self.other_user_id = other_user_id
+        self.messages = messages  # Active window, oldest first
+        self.summary: Optional[str] = None  # Rolling summary of turns dropped from the window
+        self.offset = 0  # Absolute position of messages[0] in the conversation
+        self.persisted = len(messages)  # Absolute count of messages already stored in Supabase
+        self.compacting_until: Optional[int] = None  # Absolute end of the window being summarized, if any
+        self.lock = asyncio.Lock()
+
+    @property
+    def unpersisted(self) -> List[Dict[str, str]]:
+        return self.messages[self.persisted - self.offset:]
+
+    def context(self) -> List[Dict[str, str]]:
+        """Messages to send to the model: the rolling summary followed by the active window."""
+        if self.summary is None:
+            return list(self.messages)
+        return [{"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"}, *self.messages]
+
+class ConversationSessionStore:
+    """In-memory conversation sessions keyed by user pair, persisted to Supabase in the background."""
+
+    def __init__(self,
+                 openai_service: OpenAIService,
+                 supabase_service: SupabaseService,
+                 should_summarize: Callable[[List[Dict[str, str]]], bool],
+                 max_sessions: int = 10000,
+                 flush_every: int = 10,
+                 keep_recent: int = 4):
+        self.openai_service = openai_service
+        self.supabase_service = supabase_service
+        self.should_summarize = should_summarize
+        self.max_sessions = max_sessions
+        self.flush_every = flush_every  # Unpersisted messages that trigger a background flush
+        self.keep_recent = keep_recent  # Messages kept in the window after summarizing
+        self._sessions: "OrderedDict[Tuple[str, str], ConversationSession]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    async def get(self, user_id: str, other_user_id: str) -> ConversationSession:
+        """Return the session for a pair, loading stored history only the first time."""
+        key = tuple(sorted((user_id, other_user_id)))
+        session = self._sessions.get(key)
+        if session is not None:
+            self._sessions.move_to_end(key)
+            return session
+
+        # Concurrent first messages for the same pair share one history load
+        if key not in self._loading:
+            self._loading[key] = asyncio.ensure_future(
+                self.supabase_service.get_conversation_rows(user_id, other_user_id)
+            )
+        try:
+            rows = await self._loading[key]
+        finally:
+            self._loading.pop(key, None)
+
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._restore(user_id, other_user_id, rows)
+            self._sessions[key] = session
+            self._evict()
+        return session
+
+    def _restore(self, user_id: str, other_user_id: str, rows: List[Dict[str, Any]]) -> ConversationSession:
+        """Rebuild a session from stored rows (oldest first): the latest summary and the turns since."""
+        messages, summary = [], None
+        for row in rows:
+            messages.extend(row["messages"])
+            if row["summary"]:
+                # Summarizing kept only the most recent turns verbatim
+                summary = row["summary"]
+                del messages[:max(0, len(messages) - self.keep_recent)]
+        session = ConversationSession(user_id, other_user_id, messages)
+        session.summary = summary
+        return session
+
+    def append(self, session: ConversationSession, *messages: Dict[str, str]) -> bool:
+        """Add messages to a session, returning True if summarization was scheduled."""
+        session.messages.extend(messages)
+        if session.compacting_until is None and self.should_summarize(session.messages):
+            session.compacting_until = session.offset + len(session.messages)
+            self._run_in_background(self._summarize(session))
+            return True
+        if len(session.unpersisted) >= self.flush_every:
+            self._run_in_background(self.flush(session))
+        return False
+
+    async def flush(self, session: ConversationSession) -> None:
+        """Persist messages that have not been stored yet."""
+        async with session.lock:
+            messages = session.unpersisted
+            if session.compacting_until is not None:
+                # Turns past a window being summarized are stored after its summary row
+                messages = messages[:session.compacting_until - session.persisted]
+            if not messages:
+                return
+            await self.supabase_service.save_conversation(
+                session.user_id,
+                session.other_user_id,
+                messages
+            )
+            session.persisted += len(messages)
+
+    async def _summarize(self, session: ConversationSession) -> None:
+        try:
+            summary = await self.openai_service.summarize_conversation(session.context())
+            async with session.lock:
+                window_size = session.compacting_until - session.offset
+                # The summary row closes the window, even with no turns left to store, so _restore can
+                # rebuild it; turns added meanwhile follow in later rows
+                messages = session.messages[session.persisted - session.offset:window_size]
+                await self.supabase_service.save_conversation(
+                    session.user_id,
+                    session.other_user_id,
+                    messages,
+                    summary
+                )
+                session.persisted += len(messages)
+                # Older turns now live in the summary; keep only the most recent ones verbatim
+                dropped = max(0, window_size - self.keep_recent)
+                del session.messages[:dropped]
+                session.offset += dropped
+                session.summary = summary
+        finally:
+            session.compacting_until = None
+        # Turns held back while summarizing are stored now, in case the session was evicted meanwhile
+        if session.unpersisted:
+            await self.flush(session)
+
+    def _evict(self) -> None:
+        while len(self._sessions) > self.max_sessions:
+            _, session = self._sessions.popitem(last=False)
+            self._run_in_background(self.flush(session))
+
+    def _run_in_background(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_task_done)
+
+    def _on_background_task_done(self, task: asyncio.Task) -> None:
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background conversation task failed", exc_info=task.exception())
+
+    async def drain(self) -> None:
+        """Wait for background work and persist every session's remaining messages."""
+        while self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        await asyncio.gather(*(self.flush(session) for session in self._sessions.values()),
+                             return_exceptions=True)
@@ -0,0 +1,114 @@
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+import numpy as np
+from .embedding_store import EmbeddingStore
+
+class ProfileEmbeddingIndex:
+    """Index of pre-normalized profile embeddings keyed by user_id, with group memberships."""
+
+    def __init__(self,
+                 dimension: Optional[int] = None,
+                 initial_capacity: int = 1024,
+                 store: Optional[EmbeddingStore] = None):
+        # Vectors live in the store: an in-memory float32 matrix unless a quantized/mapped store is given
+        if store is None:
+            store = EmbeddingStore(dimension=dimension, initial_capacity=initial_capacity)
+        self.store = store
+        self._user_groups: Dict[str, frozenset] = {}
+        self._group_members: Dict[str, set] = {}
+
+    @classmethod
+    def from_profiles(cls, profiles: Iterable[Dict[str, Any]]) -> "ProfileEmbeddingIndex":
+        """Build an index from user_profiles rows."""
+        index = cls()
+        for profile in profiles:
+            index.upsert_profile(profile)
+        return index
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self.store.dimension
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.store
+
+    def upsert_profile(self, profile: Dict[str, Any]) -> None:
+        """Index a user_profiles row, dropping it if it has no embedding."""
+        profile_data = profile.get("profile_data") or {}
+        embedding = profile_data.get("description_embedding")
+        if self.store.readonly:
+            # Another process owns the vectors; only group memberships are tracked here
+            self.set_groups(profile["user_id"], profile_data.get("groups") or [])
+            return
+        if not embedding:
+            self.delete(profile["user_id"])
+            return
+        self.upsert(profile["user_id"], embedding, profile_data.get("groups") or [])
+
+    def upsert(self, user_id: str, embedding: List[float], groups: Iterable[str] = ()) -> None:
+        """Insert or replace a user's embedding and group memberships."""
+        self.store.put(user_id, embedding)
+        self.set_groups(user_id, groups)
+
+    def delete(self, user_id: str) -> None:
+        self.store.delete(user_id)
+        self.set_groups(user_id, ())
+
+    def set_groups(self, user_id: str, groups: Iterable[str]) -> None:
+        """Replace a user's group memberships."""
+        groups = frozenset(groups)
+        for group_id in self._user_groups.pop(user_id, frozenset()) - groups:
+            members = self._group_members[group_id]
+            members.discard(user_id)
+            if not members:
+                del self._group_members[group_id]
+        if groups:
+            self._user_groups[user_id] = groups
+            for group_id in groups:
+                self._group_members.setdefault(group_id, set()).add(user_id)
+
+    def scores(self, query: List[float], user_ids: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Cosine similarity of the query against every row (or the given users, in order)."""
+        self.store.refresh()
+        if user_ids is None:
+            return self.store.scores(query)
+        rows = np.fromiter((self.store.row(user_id) for user_id in user_ids), dtype=np.int64)
+        return self.store.scores(query, rows)
+
+    def search(self,
+               query: List[float],
+               top_k: int = 5,
+               group_id: Optional[str] = None,
+               candidate_ids: Optional[Iterable[str]] = None,
+               exclude_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Return the top_k (user_id, similarity) pairs, best first."""
+        self.store.refresh()
+        if not len(self.store) or top_k <= 0:
+            return []
+        scores = self.store.scores(query)
+
+        mask = np.ones(len(scores), dtype=bool)
+        if group_id is not None:
+            mask &= self._rows_mask(self._group_members.get(group_id, ()))
+        if candidate_ids is not None:
+            mask &= self._rows_mask(candidate_ids)
+        if exclude_ids is not None:
+            mask &= ~self._rows_mask(exclude_ids)
+
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return []
+        k = min(top_k, candidates.size)
+        candidate_scores = scores[candidates]
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        top = top[np.argsort(-candidate_scores[top])]
+        ids = self.store.ids
+        return [(ids[candidates[i]], float(candidate_scores[i])) for i in top]
+
+    def _rows_mask(self, user_ids: Iterable[str]) -> np.ndarray:
+        mask = np.zeros(len(self.store), dtype=bool)
+        rows = [row for row in map(self.store.row, user_ids) if row is not None]
+        mask[rows] = True
+        return mask
@@ -0,0 +1,235 @@
+import fcntl
+import json
+import os
+from typing import List, Dict, Any, Optional, Iterable
+import numpy as np
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+class EmbeddingStore:
+    """Normalized embedding rows keyed by id, stored as float32, float16 or int8.
+
+    With a path, rows live in a memory-mapped file (<path>.vectors, plus <path>.scales for
+    int8) and the id -> row index in <path>.json, so other processes can open the same
+    store read-only and score against the shared pages without decoding anything. Only the
+    process holding the lock on <path>.lock writes; any other opener falls back to read-only.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 dtype: str = "float32",
+                 dimension: Optional[int] = None,
+                 readonly: bool = False,
+                 initial_capacity: int = 1024):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self.path = path
+        self.dtype = dtype
+        self.dimension = dimension
+        self.readonly = readonly
+        self._capacity = initial_capacity
+        self._ids: List[str] = []  # Row -> id, rows are kept contiguous
+        self._rows: Dict[str, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None  # Per-row dequantization factor for int8
+        self._meta_mtime: Optional[float] = None
+        self.metadata: Dict[str, Any] = {}  # Saved with the id index, e.g. the owner's sync watermark
+        self.changes = 0  # Puts and deletes since the last flush
+        self._lock_file = None  # Held open for as long as this process is the writer
+
+        if readonly and not path:
+            raise ValueError("A read-only embedding store needs a path")
+        if path and not readonly:
+            self.readonly = not self._lock()
+        if path and os.path.exists(f"{path}.json"):
+            self._open()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._rows
+
+    @property
+    def ids(self) -> List[str]:
+        return self._ids
+
+    def row(self, item_id: str) -> Optional[int]:
+        return self._rows.get(item_id)
+
+    def put(self, item_id: str, embedding: Iterable[float]) -> None:
+        """Insert or replace an embedding."""
+        self._check_writable()
+        vector = self.normalize(embedding)
+        if self.dimension is None:
+            self.dimension = vector.shape[0]
+        elif vector.shape[0] != self.dimension:
+            raise ValueError(f"Expected embedding of dimension {self.dimension}, got {vector.shape[0]}")
+        if self._vectors is None:
+            self._allocate(self._capacity)
+
+        row = self._rows.get(item_id)
+        if row is None:
+            row = len(self._ids)
+            if row == self._capacity:
+                self._allocate(self._capacity * 2)
+            self._ids.append(item_id)
+            self._rows[item_id] = row
+        self._write_row(row, vector)
+        self.changes += 1
+
+    def delete(self, item_id: str) -> None:
+        """Remove an embedding, moving the last row into the freed slot."""
+        self._check_writable()
+        row = self._rows.pop(item_id, None)
+        if row is None:
+            return
+        last = len(self._ids) - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._vectors[row] = self._vectors[last]
+            if self._scales is not None:
+                self._scales[row] = self._scales[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+        self._ids.pop()
+        self.changes += 1
+
+    def view(self) -> np.ndarray:
+        """Zero-copy view of the stored rows in their storage dtype."""
+        if self._vectors is None:
+            return np.zeros((0, self.dimension or 0), dtype=self.dtype)
+        return self._vectors[:len(self._ids)]
+
+    def get(self, item_id: str) -> np.ndarray:
+        """Dequantized float32 copy of one embedding."""
+        row = self._rows[item_id]
+        vector = self._vectors[row].astype(np.float32)
+        return vector * self._scales[row] if self._scales is not None else vector
+
+    def scores(self,
+               query: Iterable[float],
+               rows: Optional[np.ndarray] = None,
+               chunk_size: int = 16384) -> np.ndarray:
+        """Cosine similarity of the query against all rows, or the given rows in order."""
+        query = self.normalize(query)
+        if rows is None:
+            matrix, scales = self.view(), self._scales
+            if scales is not None:
+                scales = scales[:len(self._ids)]
+        else:
+            matrix = self._vectors[rows] if len(rows) else self.view()[:0]
+            scales = self._scales[rows] if self._scales is not None and len(rows) else None
+        if self.dtype == "float32":
+            return matrix @ query
+
+        # Widen in chunks so reduced-precision rows never materialize as one float32 matrix
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), chunk_size):
+            scores[start:start + chunk_size] = matrix[start:start + chunk_size].astype(np.float32) @ query
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    def flush(self) -> None:
+        """Persist rows and the id index so read-only openers see the current state."""
+        if not self.path or self.readonly or self._vectors is None:
+            return
+        self._vectors.flush()
+        if self._scales is not None:
+            self._scales.flush()
+        meta = {
+            "dimension": self.dimension,
+            "dtype": self.dtype,
+            "capacity": self._capacity,
+            "ids": self._ids,
+            "metadata": self.metadata
+        }
+        with open(f"{self.path}.json.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{self.path}.json.tmp", f"{self.path}.json")
+        self.changes = 0
+
+    def refresh(self) -> None:
+        """Re-open a read-only store if its writer has flushed since it was opened."""
+        if not self.readonly or not os.path.exists(f"{self.path}.json"):
+            return
+        if os.path.getmtime(f"{self.path}.json") != self._meta_mtime:
+            self._open()
+
+    @staticmethod
+    def normalize(embedding: Iterable[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _write_row(self, row: int, vector: np.ndarray) -> None:
+        if self.dtype == "int8":
+            scale = float(np.abs(vector).max()) / 127 or 1.0
+            self._vectors[row] = np.round(vector / scale).astype(np.int8)
+            self._scales[row] = scale
+        else:
+            self._vectors[row] = vector
+
+    def _lock(self) -> bool:
+        """Try to become the store's single writer, without waiting for another process."""
+        lock_file = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _open(self) -> None:
+        self._meta_mtime = os.path.getmtime(f"{self.path}.json")
+        with open(f"{self.path}.json") as f:
+            meta = json.load(f)
+        if meta["dtype"] != self.dtype and self._vectors is None and not self.readonly:
+            raise ValueError(f"Store at {self.path} holds {meta['dtype']} rows, not {self.dtype}")
+        self.dtype = meta["dtype"]
+        self.dimension = meta["dimension"]
+        self._capacity = meta["capacity"]
+        self._ids = meta["ids"]
+        self.metadata = meta.get("metadata", {})
+        self._rows = {item_id: row for row, item_id in enumerate(self._ids)}
+        self._map(self._capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        size = len(self._ids)
+        if not self.path:
+            vectors = np.zeros((capacity, self.dimension), dtype=self.dtype)
+            scales = np.ones(capacity, dtype=np.float32) if self.dtype == "int8" else None
+            if self._vectors is not None:
+                vectors[:size] = self._vectors[:size]
+                if scales is not None:
+                    scales[:size] = self._scales[:size]
+            self._vectors, self._scales = vectors, scales
+        else:
+            # Extend the backing files in place; existing rows keep their offsets
+            if self._vectors is not None:
+                self._vectors.flush()
+                if self._scales is not None:
+                    self._scales.flush()
+            self._resize_file(f"{self.path}.vectors", capacity * self.dimension * np.dtype(self.dtype).itemsize)
+            if self.dtype == "int8":
+                self._resize_file(f"{self.path}.scales", capacity * 4)
+            self._map(capacity)
+        self._capacity = capacity
+
+    def _map(self, capacity: int) -> None:
+        mode = "r" if self.readonly else "r+"
+        self._vectors = np.memmap(f"{self.path}.vectors", dtype=self.dtype, mode=mode,
+                                  shape=(capacity, self.dimension))
+        self._scales = np.memmap(f"{self.path}.scales", dtype=np.float32, mode=mode,
+                                 shape=(capacity,)) if self.dtype == "int8" else None
+
+    @staticmethod
+    def _resize_file(path: str, size: int) -> None:
+        with open(path, "ab") as f:
+            f.truncate(size)
+
+    def _check_writable(self) -> None:
+        if self.readonly:
+            raise PermissionError("Embedding store is open read-only")
@@ -1,4 +1,7 @@
-from typing import List, Dict, Any
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 from .openai_service import OpenAIService
 from .supabase_service import SupabaseService
 
@@ -6,23 +9,95 @@ class FriendRecommendationService:
     def __init__(self, openai_service: OpenAIService, supabase_service: SupabaseService):
         self.openai_service = openai_service
         self.supabase_service = supabase_service
+        self.freshness = timedelta(seconds=int(os.getenv("RECOMMENDATION_FRESHNESS_SECONDS", "86400")))
+        self._stale_before: Dict[str, datetime] = {}  # Stored recommendations older than this are ignored
+        self._empty_at: Dict[str, datetime] = {}  # When a computation last found nothing to store for a user
+        self.listwise_ranking = os.getenv("LISTWISE_RANKING", "true").lower() == "true"
+        # "graph" scores candidates without model calls and only has the model explain the winners;
+        # "model" scores every candidate with the model
+        self.scorer = os.getenv("RECOMMENDATION_SCORER", "graph")
+        self.graph_weight = float(os.getenv("RECOMMENDATION_GRAPH_WEIGHT", "0.5"))  # Adamic-Adar vs profile similarity
+        self.similar_users = int(os.getenv("RECOMMENDATION_SIMILAR_USERS", "100"))  # Embedding neighbours considered
 
     async def get_recommendations(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get friend recommendations for a user."""
+        """Get friend recommendations for a user, serving fresh stored ones when available."""
+        recommendations = await self.get_stored_recommendations(user_id)
+        if recommendations or self.known_empty(user_id):
+            return recommendations
+        return await self.compute_recommendations(user_id)
+
+    def invalidate(self, user_id: str) -> None:
+        """Stop serving recommendations stored before now, e.g. after a profile change."""
+        self._stale_before[user_id] = datetime.now(timezone.utc)
+        self._empty_at.pop(user_id, None)
+
+    def known_empty(self, user_id: str, max_age: Optional[timedelta] = None) -> bool:
+        """Whether a computation within the freshness window found no recommendations for the user."""
+        empty_at = self._empty_at.get(user_id)
+        return empty_at is not None and empty_at >= datetime.now(timezone.utc) - (max_age or self.freshness)
+
+    async def get_stored_recommendations(self,
+                                       user_id: str,
+                                       max_age: Optional[timedelta] = None) -> List[Dict[str, Any]]:
+        """Get recommendations stored within the freshness window, or an empty list."""
+        cutoff = datetime.now(timezone.utc) - (max_age or self.freshness)
+        cutoff = max(cutoff, self._stale_before.get(user_id, cutoff))
+        rows = await self.supabase_service.get_friend_recommendations(user_id, since=cutoff.isoformat())
+        
+        # Rows are newest first, so keep the first row per recommended user
+        latest = {}
+        for row in rows:
+            latest.setdefault(row["recommended_user_id"], row["recommendation_data"])
+        profiles = await self.supabase_service.get_user_profiles(list(latest))
+        
+        recommendations = [{
+            "user_id": recommended_user_id,
+            "profile": profiles[recommended_user_id],
+            "recommendation": data["recommendation"],
+            "confidence_score": data["confidence_score"],
+            # Only the graph scorer records mutual connections
+            **({"mutual_connections": data["mutual_connections"]} if "mutual_connections" in data else {})
+        } for recommended_user_id, data in latest.items() if recommended_user_id in profiles]
+        
+        recommendations.sort(key=lambda x: x["confidence_score"], reverse=True)
+        return recommendations[:5]
+
+    async def compute_recommendations(self, user_id: str) -> List[Dict[str, Any]]:
+        """Generate and store fresh friend recommendations for a user."""
+        recommendations = await self._compute_recommendations(user_id)
+        # An empty result stores no rows, so remember it to avoid recomputing until it goes stale
+        if recommendations:
+            self._empty_at.pop(user_id, None)
+        else:
+            self._empty_at[user_id] = datetime.now(timezone.utc)
+        return recommendations
+
+    async def _compute_recommendations(self, user_id: str) -> List[Dict[str, Any]]:
         # Get user's profile
         user_profile = await self.supabase_service.get_user_profile(user_id)
         
+        if self.scorer == "graph":
+            recommendations = await self._graph_recommendations(user_id, user_profile)
+            if recommendations is not None:
+                return recommendations
+        
         # Get potential friends
         potential_friends = await self.supabase_service.get_potential_friends(user_id)
         
         # Get recommendations from AI
+        if self.listwise_ranking:
+            scored_friends = await self._rank_listwise(user_profile, potential_friends)
+        else:
+            scored_friends = []
+            for potential_friend in potential_friends:
+                recommendation = await self.openai_service.generate_friend_recommendation(
+                    user_profile["profile_data"]["description"],
+                    [potential_friend]
+                )
+                scored_friends.append((potential_friend, recommendation))
+        
         recommendations = []
-        for potential_friend in potential_friends:
-            recommendation = await self.openai_service.generate_friend_recommendation(
-                user_profile["profile_data"]["description"],
-                [potential_friend]
-            )
-            
+        for potential_friend, recommendation in scored_friends:
             if recommendation["confidence_score"] > 0.7:  # Only include high-confidence recommendations
                 recommendations.append({
                     "user_id": potential_friend["user_id"],
@@ -43,6 +118,85 @@ class FriendRecommendationService:
         
         return recommendations[:5]  # Return top 5 recommendations
 
+    async def _graph_recommendations(self,
+                                   user_id: str,
+                                   user_profile: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Rank by Adamic-Adar over the interaction graph plus profile similarity, then explain the top 5.
+
+        The confidence_score is that blended score in [0, 1], not a model confidence, so the model
+        scorer's 0.7 cut-off does not apply: any of the top 5 with a positive score is returned.
+        Returns None when nothing scores above zero, so the caller falls back to the model scorer.
+        """
+        user_ids, mutual, adamic_adar = self.supabase_service.interaction_graph.link_scores(user_id)
+        
+        # Users with similar profiles are candidates too, so people without connections still get results
+        profile_data = user_profile["profile_data"]
+        embedding = None
+        if len(self.supabase_service.profile_index):
+            embedding = profile_data.get("description_embedding")\
+                or await self.openai_service.generate_embedding(profile_data["description"])
+            known = set(user_ids)
+            similar_ids = [other_id for other_id, _ in self.supabase_service.search_similar_users(
+                user_id,
+                embedding,
+                "friendship",
+                limit=self.similar_users
+            ) if other_id not in known]
+            user_ids = user_ids + similar_ids
+            mutual = np.concatenate([mutual, np.zeros(len(similar_ids), dtype=mutual.dtype)])
+            adamic_adar = np.concatenate([adamic_adar, np.zeros(len(similar_ids))])
+        if not user_ids:
+            return None
+        
+        similarity = self.supabase_service.profile_similarities(embedding, user_ids) if embedding is not None\
+            else np.zeros(len(user_ids))
+        # Adamic-Adar is scaled to the user's strongest link so both terms lie in [0, 1]
+        graph_score = adamic_adar / adamic_adar.max() if adamic_adar.max() > 0 else adamic_adar
+        scores = self.graph_weight * graph_score + (1 - self.graph_weight) * np.clip(similarity, 0, 1)
+        top = [i for i in np.argsort(-scores, kind="stable")[:5].tolist() if scores[i] > 0]
+        
+        # The model only writes explanations, in one batched call for the final few
+        profiles = await self.supabase_service.get_user_profiles([user_ids[i] for i in top])
+        top = [i for i in top if user_ids[i] in profiles]
+        if not top:
+            return None
+        rankings = await self.openai_service.rank_candidates(
+            profile_data["description"],
+            "friendship",
+            [{**profiles[user_ids[i]], "mutual_connections": int(mutual[i])} for i in top]
+        )
+        
+        recommendations = []
+        for i in top:
+            recommendation = {
+                "recommendation": rankings.get(user_ids[i], {}).get("reason", ""),
+                "confidence_score": round(float(scores[i]), 4),
+                "mutual_connections": int(mutual[i])
+            }
+            recommendations.append({
+                "user_id": user_ids[i],
+                "profile": profiles[user_ids[i]],
+                **recommendation
+            })
+            
+            # Save the recommendation
+            await self.supabase_service.save_friend_recommendation(user_id, user_ids[i], recommendation)
+        return recommendations
+
+    async def _rank_listwise(self,
+                           user_profile: Dict[str, Any],
+                           potential_friends: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Score all potential friends in batched ranking calls."""
+        rankings = await self.openai_service.rank_candidates(
+            user_profile["profile_data"]["description"],
+            "friendship",
+            potential_friends
+        )
+        return [(potential_friend, {
+            "recommendation": rankings[potential_friend["user_id"]]["reason"],
+            "confidence_score": rankings[potential_friend["user_id"]]["score"]
+        }) for potential_friend in potential_friends if potential_friend["user_id"] in rankings]
+
     async def get_recommendation_explanation(self, 
                                           user_id: str, 
                                           recommended_user_id: str) -> Dict[str, Any]:
@@ -56,6 +210,10 @@ class FriendRecommendationService:
             user_id,
             recommended_user_id
         )
+        conversation_summaries = self.openai_service.tokens.trim_history(
+            conversation_summaries,
+            self.openai_service.history_token_budget
+        )
         
         # Generate explanation
         explanation = await self.openai_service.generate_friend_recommendation(
@@ -0,0 +1,145 @@
+from typing import List, Dict, Optional, Iterable, Set, Tuple
+import numpy as np
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+class InteractionGraph:
+    """Undirected graph of users who have talked or interacted, as CSR arrays over int user ids.
+
+    Row u of the compressed arrays is the sorted neighbour list indices[indptr[u]:indptr[u + 1]].
+    Edges added since the last compaction sit in a per-user delta set, which is merged into the
+    arrays once it grows past compact_ratio of the stored edges.
+    """
+
+    def __init__(self, compact_ratio: float = 0.1):
+        self.compact_ratio = compact_ratio
+        self._ids: Dict[str, int] = {}
+        self._user_ids: List[str] = []  # int id -> user_id
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = _EMPTY
+        self._delta: Dict[int, Set[int]] = {}  # int id -> neighbours not yet compacted
+        self._delta_edges = 0
+
+    def __len__(self) -> int:
+        """Number of users with at least one edge."""
+        return len(self._user_ids)
+
+    @property
+    def edge_count(self) -> int:
+        """Stored neighbour entries, two per undirected edge."""
+        return len(self._indices) + self._delta_edges
+
+    def add_edge(self, user_id: str, other_user_id: str) -> None:
+        """Record that two users interacted."""
+        if user_id == other_user_id:
+            return
+        a, b = self._id(user_id), self._id(other_user_id)
+        if self._has_edge(a, b):
+            return
+        self._delta.setdefault(a, set()).add(b)
+        self._delta.setdefault(b, set()).add(a)
+        self._delta_edges += 2
+        if self._delta_edges > max(1024, self.compact_ratio * len(self._indices)):
+            self.compact()
+
+    def add_edges(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        """Bulk-load edges, e.g. from the conversations and interactions tables, in one compaction."""
+        sources, targets = [], []
+        for user_id, other_user_id in pairs:
+            if user_id != other_user_id:
+                sources.append(self._id(user_id))
+                targets.append(self._id(other_user_id))
+        self.compact(np.asarray(sources, dtype=np.int32), np.asarray(targets, dtype=np.int32))
+
+    def compact(self, sources: np.ndarray = _EMPTY, targets: np.ndarray = _EMPTY) -> None:
+        """Merge the delta sets (and any given edges) into the CSR arrays."""
+        delta_sources = np.fromiter((u for u, vs in self._delta.items() for _ in vs), dtype=np.int32,
+                                    count=self._delta_edges)
+        delta_targets = np.fromiter((v for vs in self._delta.values() for v in vs), dtype=np.int32,
+                                    count=self._delta_edges)
+        stored_sources = np.repeat(np.arange(len(self._indptr) - 1, dtype=np.int32), np.diff(self._indptr))
+        # Delta edges are already symmetric; bulk edges are mirrored here
+        rows = np.concatenate([stored_sources, delta_sources, sources, targets])
+        cols = np.concatenate([self._indices, delta_targets, targets, sources])
+
+        n = len(self._user_ids)
+        if n == 0:
+            return
+        keys = np.unique(rows.astype(np.int64) * n + cols)  # Sorts by row, then neighbour, and dedupes
+        rows, self._indices = (keys // n).astype(np.int32), (keys % n).astype(np.int32)
+        self._indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=self._indptr[1:])
+        self._delta = {}
+        self._delta_edges = 0
+
+    def has_interacted(self, user_id: str, other_user_id: str) -> bool:
+        a, b = self._ids.get(user_id), self._ids.get(other_user_id)
+        return a is not None and b is not None and self._has_edge(a, b)
+
+    def degree(self, user_id: str) -> int:
+        uid = self._ids.get(user_id)
+        if uid is None:
+            return 0
+        return self._row_length(uid) + len(self._delta.get(uid, ()))
+
+    def neighbors(self, user_id: str) -> List[str]:
+        uid = self._ids.get(user_id)
+        if uid is None:
+            return []
+        return [self._user_ids[v] for v in self._neighbors(uid).tolist()]
+
+    def friends_of_friends(self, user_id: str, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Users two hops away that user_id has not interacted with, by mutual neighbour count."""
+        user_ids, mutual, _ = self.link_scores(user_id)
+        order = np.argsort(-mutual, kind="stable")  # Ties keep ascending id order
+        if limit is not None:
+            order = order[:limit]
+        return [(user_ids[i], int(mutual[i])) for i in order.tolist()]
+
+    def link_scores(self, user_id: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Users two hops away that user_id has not interacted with, their mutual neighbour counts and
+        Adamic-Adar scores (the sum of 1 / log(degree) over mutual neighbours)."""
+        uid = self._ids.get(user_id)
+        direct = self._neighbors(uid) if uid is not None else _EMPTY
+        if not len(direct):
+            return [], np.zeros(0, dtype=np.int64), np.zeros(0)
+        rows = [self._neighbors(v) for v in direct.tolist()]
+        degrees = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+        # Every mutual neighbour has user_id as a neighbour too, so its degree is at least 2 when it counts
+        weights = np.repeat(1 / np.log(np.maximum(degrees, 2)), degrees)
+        candidates, inverse, mutual = np.unique(np.concatenate(rows), return_inverse=True, return_counts=True)
+        adamic_adar = np.bincount(inverse, weights=weights, minlength=len(candidates))
+        keep = (candidates != uid) & ~np.isin(candidates, direct, assume_unique=True)
+        return [self._user_ids[v] for v in candidates[keep].tolist()], mutual[keep], adamic_adar[keep]
+
+    def _id(self, user_id: str) -> int:
+        uid = self._ids.get(user_id)
+        if uid is None:
+            uid = self._ids[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+        return uid
+
+    def _row_length(self, uid: int) -> int:
+        # Users added since the last compaction have no CSR row yet
+        if uid + 1 >= len(self._indptr):
+            return 0
+        return int(self._indptr[uid + 1] - self._indptr[uid])
+
+    def _row(self, uid: int) -> np.ndarray:
+        if uid + 1 >= len(self._indptr):
+            return _EMPTY
+        return self._indices[self._indptr[uid]:self._indptr[uid + 1]]
+
+    def _has_edge(self, a: int, b: int) -> bool:
+        if b in self._delta.get(a, ()):
+            return True
+        row = self._row(a)
+        position = np.searchsorted(row, b)
+        return position < len(row) and row[position] == b
+
+    def _neighbors(self, uid: int) -> np.ndarray:
+        row = self._row(uid)
+        delta = self._delta.get(uid)
+        if not delta:
+            return row
+        return np.union1d(row, np.fromiter(delta, dtype=np.int32, count=len(delta)))
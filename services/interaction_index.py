@@ -0,0 +1,265 @@
+import json
+import os
+from typing import List, Dict, Any, Optional, Callable, Tuple
+import numpy as np
+
+# Interaction fields kept alongside each vector and returned with search results
+INDEXED_FIELDS = ("id", "user1_id", "user2_id", "interaction_type", "group_id", "summary")
+
+class _Partition:
+    """Vectors for one (interaction_type, group_id) pair, with an optional IVF coarse quantizer.
+
+    Once trained, rows [0, packed) are ordered by inverted list so each list is a contiguous
+    slice of the matrix; rows added later form a tail. add() only appends: training and
+    re-packing happen on a copy (see rebuilt), so rows already added are never rewritten.
+    """
+
+    def __init__(self, dimension: int, capacity: int = 1024):
+        self.vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self.assignments = np.zeros(capacity, dtype=np.int32)  # Row -> inverted list
+        self.records: List[Dict[str, Any]] = []
+        self.size = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.offsets: Optional[np.ndarray] = None  # List c occupies rows offsets[c]:offsets[c + 1]
+        self.packed = 0
+        self.trained_size = 0
+
+    def add(self, vector: np.ndarray, record: Dict[str, Any]) -> None:
+        if self.size == self.vectors.shape[0]:
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.assignments = np.concatenate([self.assignments, np.zeros_like(self.assignments)])
+        row = self.size
+        self.vectors[row] = vector
+        self.records.append(record)
+        self.size += 1
+        if self.centroids is not None:
+            self.assignments[row] = int(np.argmax(self.centroids @ vector))
+
+    def needs_training(self, train_threshold: int) -> bool:
+        # Train once the partition is large enough, and retrain as it keeps growing
+        return self.size >= train_threshold and self.size >= 4 * self.trained_size
+
+    def due(self, train_threshold: int) -> bool:
+        """Whether the partition should be (re)trained or its tail re-packed."""
+        if self.needs_training(train_threshold):
+            return True
+        return self.centroids is not None and self.size - self.packed > max(1024, self.packed // 10)
+
+    def rebuilt(self, size: int, records: List[Dict[str, Any]], n_lists: Optional[int] = None) -> "_Partition":
+        """Packed copy of rows [0, size), retrained with n_lists lists if given.
+
+        Safe to run in another thread while add() keeps appending, since rows below size are never
+        rewritten in place.
+        """
+        partition = _Partition(self.vectors.shape[1], capacity=max(size, 1))
+        partition.vectors[:size] = self.vectors[:size]
+        partition.assignments[:size] = self.assignments[:size]
+        partition.records = records
+        partition.size = size
+        partition.centroids = self.centroids
+        partition.trained_size = self.trained_size
+        if n_lists:
+            partition.train(n_lists)
+        else:
+            partition._pack()
+        return partition
+
+    def train(self, n_lists: int, iterations: int = 10, seed: int = 0) -> None:
+        """Cluster the vectors with spherical k-means and rebuild the inverted lists."""
+        vectors = self.vectors[:self.size]
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(self.size, min(self.size, 64 * n_lists), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for cell in range(n_lists):
+                members = sample[labels == cell]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cell] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        self.centroids = centroids
+        self.assignments[:self.size] = np.concatenate([
+            np.argmax(vectors[start:start + 65536] @ centroids.T, axis=1)
+            for start in range(0, self.size, 65536)
+        ])
+        self.trained_size = self.size
+        self._pack()
+
+    def search(self, query: np.ndarray, limit: int, n_probe: int) -> List[Tuple[float, int]]:
+        if self.centroids is None:
+            rows = np.arange(self.size)
+            scores = self.vectors[:self.size] @ query
+        else:
+            probes = np.argpartition(-(self.centroids @ query), min(n_probe, len(self.centroids)) - 1)[:n_probe]
+            tail = np.arange(self.packed, self.size)
+            tail = tail[np.isin(self.assignments[self.packed:self.size], probes)]
+            rows = np.concatenate([np.arange(self.offsets[cell], self.offsets[cell + 1]) for cell in probes] + [tail])
+            scores = np.concatenate(
+                [self.vectors[self.offsets[cell]:self.offsets[cell + 1]] @ query for cell in probes]
+                + [self.vectors[tail] @ query]
+            )
+        if rows.size == 0:
+            return []
+        k = min(limit, rows.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(float(scores[i]), int(rows[i])) for i in top]
+
+    def _pack(self) -> None:
+        # Reorder all rows by inverted list so every list is contiguous again
+        order = np.argsort(self.assignments[:self.size], kind="stable")
+        self.vectors[:self.size] = self.vectors[order]
+        self.assignments[:self.size] = self.assignments[order]
+        self.records = [self.records[i] for i in order]
+        self.offsets = np.searchsorted(self.assignments[:self.size], np.arange(len(self.centroids) + 1))
+        self.packed = self.size
+
+class InteractionIndex:
+    """Approximate nearest-neighbour index over interaction embeddings, partitioned by type and group."""
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 train_threshold: int = 4096,
+                 n_probe: int = 8):
+        self.path = path  # Base path for persistence, without extension
+        self.train_threshold = train_threshold  # Partitions below this size are searched exactly
+        self.n_probe = n_probe  # Inverted lists scanned per query
+        self.dimension: Optional[int] = None
+        self._partitions: Dict[Tuple[str, Optional[str]], _Partition] = {}
+        self.changes = 0  # Rows added since the last snapshot
+        self._ids: set = set()  # Database ids indexed, so catching up after a load never duplicates rows
+
+    def __len__(self) -> int:
+        return sum(partition.size for partition in self._partitions.values())
+
+    def __contains__(self, interaction_id: int) -> bool:
+        return interaction_id in self._ids
+
+    def add(self, interaction: Dict[str, Any]) -> None:
+        """Index an interaction row; rows without an embedding or already indexed are ignored."""
+        interaction_id = interaction.get("id")
+        if interaction_id is not None and interaction_id in self._ids:
+            return
+        embedding = interaction.get("embedding")
+        if isinstance(embedding, str):  # pgvector columns come back as "[0.1,0.2,...]"
+            embedding = json.loads(embedding)
+        if embedding is None or len(embedding) == 0:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        if self.dimension is None:
+            self.dimension = vector.shape[0]
+
+        key = (interaction["interaction_type"], interaction.get("group_id"))
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = self._partitions[key] = _Partition(self.dimension)
+        partition.add(vector, {field: interaction.get(field) for field in INDEXED_FIELDS})
+        if interaction_id is not None:
+            self._ids.add(interaction_id)
+        self.changes += 1
+
+    def due(self) -> List[Tuple[str, Optional[str]]]:
+        """Keys of partitions to pass to rebuild() and swap()."""
+        return [key for key, partition in self._partitions.items() if partition.due(self.train_threshold)]
+
+    def rebuild(self, key: Tuple[str, Optional[str]]) -> Callable[[], _Partition]:
+        """Capture a partition's current rows and return the slow part of rebuilding it, which may run
+        in another thread: k-means once it has grown enough to (re)train, otherwise a re-pack."""
+        partition = self._partitions[key]
+        size, records = partition.size, partition.records[:partition.size]
+        n_lists = int(np.sqrt(size)) if partition.needs_training(self.train_threshold) else None
+        return lambda: partition.rebuilt(size, records, n_lists)
+
+    def swap(self, key: Tuple[str, Optional[str]], rebuilt: _Partition) -> None:
+        """Replace a partition with its rebuilt copy, re-adding rows appended since rebuild()."""
+        partition = self._partitions[key]
+        for row in range(rebuilt.size, partition.size):
+            rebuilt.add(partition.vectors[row], partition.records[row])
+        self._partitions[key] = rebuilt
+
+    def maintain(self) -> None:
+        """Rebuild every due partition in the calling thread."""
+        for key in self.due():
+            self.swap(key, self.rebuild(key)())
+
+    def search(self,
+               embedding: List[float],
+               interaction_type: str,
+               group_id: Optional[str] = None,
+               limit: int = 5) -> List[Dict[str, Any]]:
+        """Return the most similar interactions with their cosine similarity_score."""
+        if self.dimension is None:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+
+        partitions = [partition for (partition_type, partition_group), partition in self._partitions.items()
+                      if partition_type == interaction_type and (group_id is None or partition_group == group_id)]
+        hits = []
+        for partition in partitions:
+            hits.extend((score, row, partition) for score, row in partition.search(query, limit, self.n_probe))
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [{**partition.records[row], "similarity_score": score} for score, row, partition in hits[:limit]]
+
+    def save(self) -> None:
+        """Write vectors to <path>.npz and records to <path>.json."""
+        if not self.path:
+            return
+        self.write(self.snapshot())
+
+    def snapshot(self) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        """Copy the index state for write(), which may then run off the event loop."""
+        arrays = {}
+        manifest = {"dimension": self.dimension, "partitions": []}
+        for i, ((interaction_type, group_id), partition) in enumerate(self._partitions.items()):
+            arrays[f"vectors_{i}"] = partition.vectors[:partition.size].copy()
+            if partition.centroids is not None:
+                arrays[f"centroids_{i}"] = partition.centroids.copy()
+                arrays[f"assignments_{i}"] = partition.assignments[:partition.size].copy()
+                arrays[f"offsets_{i}"] = partition.offsets.copy()
+            manifest["partitions"].append({
+                "interaction_type": interaction_type,
+                "group_id": group_id,
+                "records": list(partition.records),
+                "trained_size": partition.trained_size,
+                "packed": partition.packed
+            })
+        self.changes = 0
+        return arrays, manifest
+
+    def write(self, snapshot: Tuple[Dict[str, np.ndarray], Dict[str, Any]]) -> None:
+        arrays, manifest = snapshot
+        with open(f"{self.path}.npz.tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(f"{self.path}.npz.tmp", f"{self.path}.npz")
+        with open(f"{self.path}.json.tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(f"{self.path}.json.tmp", f"{self.path}.json")
+
+    def load(self) -> bool:
+        """Load a saved index, returning False if there is nothing to load."""
+        if not self.path or not os.path.exists(f"{self.path}.json"):
+            return False
+        with open(f"{self.path}.json") as f:
+            manifest = json.load(f)
+        arrays = np.load(f"{self.path}.npz")
+        self.dimension = manifest["dimension"]
+        self.changes = 0
+        self._partitions = {}
+        for i, entry in enumerate(manifest["partitions"]):
+            vectors = arrays[f"vectors_{i}"]
+            partition = _Partition(self.dimension, capacity=max(len(vectors), 1))
+            partition.vectors[:len(vectors)] = vectors
+            partition.size = len(vectors)
+            partition.records = entry["records"]
+            partition.trained_size = entry["trained_size"]
+            if f"centroids_{i}" in arrays.files:
+                partition.centroids = arrays[f"centroids_{i}"]
+                partition.assignments[:partition.size] = arrays[f"assignments_{i}"]
+                partition.offsets = arrays[f"offsets_{i}"]
+                partition.packed = entry["packed"]
+            self._partitions[(entry["interaction_type"], entry["group_id"])] = partition
+        self._ids = {record["id"] for partition in self._partitions.values() for record in partition.records
+                     if record["id"] is not None}
+        return True
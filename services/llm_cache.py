@@ -0,0 +1,99 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional
+from .cache import TTLCache
+
+# Seconds each call type stays cached; None caches indefinitely and 0 disables caching
+DEFAULT_TTLS: Dict[str, Optional[float]] = {
+    "chat_response": 0,
+    "user_description": 3600,
+    "summary": 24 * 3600,
+    "simulation": 6 * 3600,
+    "best_match": 6 * 3600,
+    "ranking": 6 * 3600,
+    "friend_recommendation": 6 * 3600,
+    "embedding": None
+}
+
+class LLMCache:
+    """Content-addressed cache of model responses with an LRU memory tier and optional SQLite tier."""
+
+    def __init__(self,
+                 max_size: int = 2048,
+                 path: Optional[str] = None,
+                 ttls: Optional[Dict[str, Optional[float]]] = None):
+        self.memory = TTLCache(max_size)
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, call_type TEXT, value TEXT, expires_at REAL)"
+            )
+
+    @staticmethod
+    def make_key(model: str, payload: Any, **params: Any) -> str:
+        """Hash the model, messages (or embedding input) and request parameters."""
+        encoded = json.dumps({"model": model, "payload": payload, "params": params},
+                             sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def enabled(self, call_type: str) -> bool:
+        return self.ttls.get(call_type, 0) != 0
+
+    def get(self, call_type: str, key: str) -> Optional[Any]:
+        """Return a cached response, checking memory first and then the persistent tier."""
+        if not self.enabled(call_type):
+            return None
+        value = self.memory.get(key)
+        if value is None and self._db is not None:
+            value = self._load(key)
+        if value is None:
+            self.misses[call_type] += 1
+        else:
+            self.hits[call_type] += 1
+        return value
+
+    def set(self, call_type: str, key: str, value: Any) -> None:
+        if not self.enabled(call_type):
+            return
+        ttl = self.ttls.get(call_type)
+        self.memory.set(key, value, ttl)
+        if self._db is not None:
+            expires_at = time.time() + ttl if ttl is not None else None
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, call_type, value, expires_at) VALUES (?, ?, ?, ?)",
+                (key, call_type, json.dumps(value), expires_at)
+            )
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.stats(),
+            "hits": dict(self.hits),
+            "misses": dict(self.misses)
+        }
+
+    def _load(self, key: str) -> Optional[Any]:
+        row = self._db.execute(
+            "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        value = json.loads(value)
+        # Promote to the memory tier for the remainder of its lifetime
+        self.memory.set(key, value, expires_at - time.time() if expires_at is not None else None)
+        return value
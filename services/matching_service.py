@@ -1,51 +1,269 @@
-from typing import List, Dict, Any, Optional
+import asyncio
+import logging
+import os
+import time
+from typing import List, Dict, Any, Optional, Callable, Awaitable, AsyncIterator
 from .openai_service import OpenAIService
 from .supabase_service import SupabaseService
 
+logger = logging.getLogger(__name__)
+
 class MatchingService:
     def __init__(self, openai_service: OpenAIService, supabase_service: SupabaseService):
         self.openai_service = openai_service
         self.supabase_service = supabase_service
+        self.max_concurrency = int(os.getenv("MATCHING_MAX_CONCURRENCY", "5"))  # Candidates evaluated in parallel
+        self.listwise_ranking = os.getenv("LISTWISE_RANKING", "true").lower() == "true"
+        # Pipeline mode: cheap retrieval over a wide candidate set, then LLM evaluation of a shortlist only
+        self.pipeline = os.getenv("MATCHING_PIPELINE", "false").lower() == "true"
+        self.retrieval_size = int(os.getenv("MATCHING_RETRIEVAL_SIZE", "200"))  # Candidates scored in stage 1
+        self.shortlist_size = int(os.getenv("MATCHING_SHORTLIST_SIZE", "10"))  # Candidates simulated in stage 2
+        self.interest_weight = float(os.getenv("MATCHING_INTEREST_WEIGHT", "0.2"))  # Interest overlap vs similarity
 
     async def find_matches(self,
                           user_id: str,
                           interaction_type: str,
                           use_embeddings: bool = False,
-                          group_id: Optional[str] = None) -> List[Dict[str, Any]]:
+                          group_id: Optional[str] = None,
+                          concurrent: bool = True,
+                          pipeline: Optional[bool] = None,
+                          retrieval_size: Optional[int] = None,
+                          shortlist_size: Optional[int] = None) -> List[Dict[str, Any]]:
         """Find matches for a user using either traditional or embedding-based matching."""
         # Get user's profile
         user_profile = await self.supabase_service.get_user_profile(user_id)
         
+        # Get potential matches
+        potential_matches = await self._potential_matches(
+            user_id,
+            user_profile,
+            interaction_type,
+            group_id,
+            pipeline,
+            retrieval_size,
+            shortlist_size
+        )
+        
         if use_embeddings:
             return await self._find_embedding_matches(
                 user_id,
                 user_profile,
                 interaction_type,
-                group_id
+                potential_matches,
+                group_id,
+                concurrent
             )
         else:
             return await self._find_traditional_matches(
-                user_id,
                 user_profile,
                 interaction_type,
+                potential_matches,
+                group_id,
+                concurrent
+            )
+
+    async def stream_matches(self,
+                             user_id: str,
+                             interaction_type: str,
+                             use_embeddings: bool = False,
+                             group_id: Optional[str] = None,
+                             concurrent: bool = True,
+                             pipeline: Optional[bool] = None,
+                             retrieval_size: Optional[int] = None,
+                             shortlist_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield a candidate frame for each match as soon as it is evaluated, then the final top matches."""
+        user_profile = await self.supabase_service.get_user_profile(user_id)
+        potential_matches = await self._potential_matches(
+            user_id,
+            user_profile,
+            interaction_type,
+            group_id,
+            pipeline,
+            retrieval_size,
+            shortlist_size
+        )
+        if use_embeddings:
+            evaluate = self._embedding_evaluator(user_id, user_profile, interaction_type, group_id)
+        else:
+            evaluate = self._simulation_evaluator(user_profile, interaction_type, group_id)
+
+        # Each candidate is sent as soon as it is evaluated. Listwise scores arrive per ranking batch, so
+        # those candidates go out unscored and a score frame follows once their batch is ranked, while the
+        # remaining simulations keep running
+        listwise = not use_embeddings and self.listwise_ranking
+        run = self._bounded(evaluate, concurrent)
+        evaluations = {asyncio.ensure_future(run(candidate)) for candidate in potential_matches}
+        rankings: Dict[asyncio.Future, List[Dict[str, Any]]] = {}
+        matches, unscored = [], []
+        try:
+            while evaluations or rankings:
+                done, _ = await asyncio.wait(evaluations | rankings.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task in rankings:
+                        task.result()
+                        for match in rankings.pop(task):
+                            yield {
+                                "type": "score",
+                                "user_id": match["user_id"],
+                                "match_reason": match["match_reason"],
+                                "confidence_score": match["confidence_score"]
+                            }
+                        continue
+                    evaluations.discard(task)
+                    match = task.result()
+                    if match is None:
+                        continue
+                    matches.append(match)
+                    if listwise:
+                        unscored.append(match)
+                    yield {"type": "candidate", "match": match}
+                if unscored and (len(unscored) >= self.openai_service.ranking_batch_size or not evaluations):
+                    ranking = asyncio.ensure_future(self._rank_listwise(user_profile, interaction_type, unscored))
+                    rankings[ranking] = unscored
+                    unscored = []
+        finally:
+            # The consumer stopped early (e.g. the client disconnected); drop the remaining work
+            for task in [*evaluations, *rankings]:
+                task.cancel()
+
+        yield {
+            "type": "final",
+            "matches": self._top_by_similarity(matches) if use_embeddings else self._top_by_confidence(matches)
+        }
+
+    async def _potential_matches(self,
+                                 user_id: str,
+                                 user_profile: Dict[str, Any],
+                                 interaction_type: str,
+                                 group_id: Optional[str],
+                                 pipeline: Optional[bool],
+                                 retrieval_size: Optional[int],
+                                 shortlist_size: Optional[int]) -> List[Dict[str, Any]]:
+        """Candidates to evaluate: the stage-1 shortlist in pipeline mode, otherwise a plain candidate page."""
+        if not (self.pipeline if pipeline is None else pipeline):
+            return await self.supabase_service.get_potential_matches(
+                user_id,
+                interaction_type,
                 group_id
             )
+        return await self._shortlist(
+            user_id,
+            user_profile,
+            interaction_type,
+            group_id,
+            retrieval_size or self.retrieval_size,
+            shortlist_size or self.shortlist_size
+        )
+
+    async def _shortlist(self,
+                         user_id: str,
+                         user_profile: Dict[str, Any],
+                         interaction_type: str,
+                         group_id: Optional[str],
+                         retrieval_size: int,
+                         shortlist_size: int) -> List[Dict[str, Any]]:
+        """Stage 1: retrieve candidates by profile-embedding similarity, rerank with interest overlap, keep the best."""
+        profile_data = user_profile["profile_data"]
+        retrieved = []
+        if len(self.supabase_service.profile_index):
+            embedding = profile_data.get("description_embedding")\
+                or await self.openai_service.generate_embedding(profile_data["description"])
+            retrieved = await self.supabase_service.search_potential_matches(
+                user_id,
+                embedding,
+                interaction_type,
+                group_id,
+                retrieval_size
+            )
+        if not retrieved:
+            # No profile embeddings to search, so interests alone order a plain candidate page
+            candidates = await self.supabase_service.get_potential_matches(
+                user_id,
+                interaction_type,
+                group_id,
+                limit=retrieval_size
+            )
+            retrieved = [(candidate, 0.0) for candidate in candidates]
+
+        interests = self._interests(profile_data)
+        scored = [(
+            similarity + self.interest_weight * self._overlap(interests, self._interests(candidate["profile_data"])),
+            candidate
+        ) for candidate, similarity in retrieved]
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [candidate for _, candidate in scored[:shortlist_size]]
+
+    @staticmethod
+    def _interests(profile_data: Optional[Dict[str, Any]]) -> frozenset:
+        return frozenset(interest.strip().lower() for interest in (profile_data or {}).get("interests") or [])
+
+    @staticmethod
+    def _overlap(a: frozenset, b: frozenset) -> float:
+        """Jaccard similarity of two interest sets."""
+        return len(a & b) / len(a | b) if a and b else 0.0
+
+    def _bounded(self,
+                 evaluate: Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]],
+                 concurrent: bool) -> Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]:
+        """Wrap an evaluator with the concurrency limit, timing, and failure logging."""
+        semaphore = asyncio.Semaphore(self.max_concurrency if concurrent else 1)
+
+        async def run(candidate: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    result = await evaluate(candidate)
+                except Exception:
+                    logger.exception("Failed to evaluate candidate %s", candidate.get("user_id"))
+                    return None
+                if result is not None:
+                    result["evaluation_seconds"] = round(time.perf_counter() - start, 3)
+                return result
+        return run
+
+    async def _evaluate_candidates(self,
+                                 candidates: List[Dict[str, Any]],
+                                 evaluate: Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]],
+                                 concurrent: bool = True) -> List[Dict[str, Any]]:
+        """Evaluate candidates under the concurrency limit, skipping any that fail."""
+        run = self._bounded(evaluate, concurrent)
+        results = await asyncio.gather(*(run(candidate) for candidate in candidates))
+        return [result for result in results if result is not None]
+
+    async def _rank_listwise(self,
+                           user_profile: Dict[str, Any],
+                           interaction_type: str,
+                           matches: List[Dict[str, Any]]) -> None:
+        """Score simulated matches in batched ranking calls, filling in reason and confidence."""
+        rankings = await self.openai_service.rank_candidates(
+            user_profile["profile_data"]["description"],
+            interaction_type,
+            [{**match["profile"], "simulated_interaction": match["conversation_summary"]} for match in matches]
+        )
+        for match in matches:
+            ranking = rankings.get(match["user_id"], {"score": 0.0, "reason": ""})
+            match["match_reason"] = ranking["reason"]
+            match["confidence_score"] = ranking["score"]
 
     async def _find_traditional_matches(self,
-                                      user_id: str,
                                       user_profile: Dict[str, Any],
                                       interaction_type: str,
-                                      group_id: Optional[str] = None) -> List[Dict[str, Any]]:
+                                      potential_matches: List[Dict[str, Any]],
+                                      group_id: Optional[str] = None,
+                                      concurrent: bool = True) -> List[Dict[str, Any]]:
         """Find matches using traditional AI-based matching."""
-        # Get potential matches
-        potential_matches = await self.supabase_service.get_potential_matches(
-            user_id,
-            interaction_type,
-            group_id
-        )
-        
-        matches = []
-        for potential_match in potential_matches:
+        evaluate = self._simulation_evaluator(user_profile, interaction_type, group_id)
+        matches = await self._evaluate_candidates(potential_matches, evaluate, concurrent)
+        if self.listwise_ranking:
+            await self._rank_listwise(user_profile, interaction_type, matches)
+        return self._top_by_confidence(matches)
+
+    def _simulation_evaluator(self,
+                              user_profile: Dict[str, Any],
+                              interaction_type: str,
+                              group_id: Optional[str]) -> Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]:
+        """Build the traditional per-candidate evaluation: simulate, then score unless ranking listwise."""
+        async def evaluate(potential_match: Dict[str, Any]) -> Optional[Dict[str, Any]]:
             # Simulate interaction between user models
             conversation, summary = await self.openai_service.simulate_model_interaction(
                 user_profile["profile_data"]["description"],
@@ -53,23 +271,29 @@ class MatchingService:
                 interaction_type
             )
             
-            # Get match recommendation
-            recommendation = await self.openai_service.find_best_match(
-                user_profile["profile_data"]["description"],
-                interaction_type,
-                [potential_match]
-            )
+            match = {
+                "user_id": potential_match["user_id"],
+                "profile": potential_match,
+                "conversation_summary": summary,
+                "interaction_type": interaction_type,
+                "group_id": group_id
+            }
             
-            if recommendation["confidence_score"] > 0.7:  # Only include high-confidence matches
-                matches.append({
-                    "user_id": potential_match["user_id"],
-                    "profile": potential_match,
-                    "conversation_summary": summary,
-                    "match_reason": recommendation["recommendation"],
-                    "confidence_score": recommendation["confidence_score"],
-                    "interaction_type": interaction_type,
-                    "group_id": group_id
-                })
+            if not self.listwise_ranking:
+                # Get match recommendation
+                recommendation = await self.openai_service.find_best_match(
+                    user_profile["profile_data"]["description"],
+                    interaction_type,
+                    [potential_match]
+                )
+                match["match_reason"] = recommendation["recommendation"]
+                match["confidence_score"] = recommendation["confidence_score"]
+            return match
+        return evaluate
+
+    @staticmethod
+    def _top_by_confidence(matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        matches = [match for match in matches if match["confidence_score"] > 0.7]  # Only include high-confidence matches
         
         # Sort by confidence score
         matches.sort(key=lambda x: x["confidence_score"], reverse=True)
@@ -79,17 +303,21 @@ class MatchingService:
                                     user_id: str,
                                     user_profile: Dict[str, Any],
                                     interaction_type: str,
-                                    group_id: Optional[str] = None) -> List[Dict[str, Any]]:
+                                    potential_matches: List[Dict[str, Any]],
+                                    group_id: Optional[str] = None,
+                                    concurrent: bool = True) -> List[Dict[str, Any]]:
         """Find matches using embedding-based matching."""
-        # Get potential matches
-        potential_matches = await self.supabase_service.get_potential_matches(
-            user_id,
-            interaction_type,
-            group_id
-        )
-        
-        matches = []
-        for potential_match in potential_matches:
+        evaluate = self._embedding_evaluator(user_id, user_profile, interaction_type, group_id)
+        matches = await self._evaluate_candidates(potential_matches, evaluate, concurrent)
+        return self._top_by_similarity(matches)
+
+    def _embedding_evaluator(self,
+                             user_id: str,
+                             user_profile: Dict[str, Any],
+                             interaction_type: str,
+                             group_id: Optional[str]) -> Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]:
+        """Build the embedding per-candidate evaluation: simulate, embed, compare with past interactions."""
+        async def evaluate(potential_match: Dict[str, Any]) -> Optional[Dict[str, Any]]:
             # Simulate interaction between user models
             conversation, summary = await self.openai_service.simulate_model_interaction(
                 user_profile["profile_data"]["description"],
@@ -101,6 +329,13 @@ class MatchingService:
             interaction_text = f"Interaction Type: {interaction_type}\nSummary: {summary}"
             interaction_embedding = await self.openai_service.generate_embedding(interaction_text)
             
+            # Find similar interactions, before saving so this one is not its own neighbour
+            similar_interactions = await self.supabase_service.find_similar_interactions(
+                interaction_embedding,
+                interaction_type,
+                group_id
+            )
+            
             # Save the interaction
             await self.supabase_service.save_interaction(
                 user_id,
@@ -112,26 +347,22 @@ class MatchingService:
                 group_id
             )
             
-            # Find similar interactions
-            similar_interactions = await self.supabase_service.find_similar_interactions(
-                interaction_embedding,
-                interaction_type,
-                group_id
-            )
-            
             # Calculate average similarity score
             similarity_scores = [interaction["similarity_score"] for interaction in similar_interactions]
             avg_similarity = sum(similarity_scores) / len(similarity_scores) if similarity_scores else 0
             
-            matches.append({
+            return {
                 "user_id": potential_match["user_id"],
                 "profile": potential_match,
                 "conversation_summary": summary,
                 "similarity_score": avg_similarity,
                 "interaction_type": interaction_type,
                 "group_id": group_id
-            })
-        
+            }
+        return evaluate
+
+    @staticmethod
+    def _top_by_similarity(matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         # Sort by similarity score
         matches.sort(key=lambda x: x["similarity_score"], reverse=True)
         return matches[:5]  # Return top 5 matches 
\ No newline at end of file
@@ -0,0 +1,233 @@
+import contextvars
+import functools
+import inspect
+import time
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterable
+
+from starlette.datastructures import MutableHeaders
+from starlette.routing import Match
+
+# Endpoint (route template) of the request being served; background work is labelled as such
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="background")
+# Spans collected for the Server-Timing header when the request asked for a trace
+_current_trace: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+class Metrics:
+    """Process-local counters, gauges and histograms rendered in the Prometheus text format."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._descriptions: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._counters: Dict[str, Dict[LabelSet, float]] = defaultdict(lambda: defaultdict(float))
+        self._gauges: Dict[str, Dict[LabelSet, float]] = defaultdict(lambda: defaultdict(float))
+        self._histograms: Dict[str, Dict[LabelSet, List[float]]] = defaultdict(dict)
+        self._callbacks: List[Tuple[str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]]] = []
+
+        self.describe("http_requests_total", "counter", "HTTP requests by endpoint and status")
+        self.describe("http_request_duration_seconds", "histogram", "HTTP request latency by endpoint")
+        self.describe("http_requests_in_flight", "gauge", "HTTP requests currently being served")
+        self.describe("upstream_calls_total", "counter", "Service method calls by component, method and endpoint")
+        self.describe("upstream_errors_total", "counter", "Service method calls that raised")
+        self.describe("upstream_call_duration_seconds", "histogram", "Service method latency")
+        self.describe("upstream_calls_in_flight", "gauge", "Service method calls currently running")
+        self.describe("openai_tokens_total", "counter", "Model tokens by call type, direction and endpoint")
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._descriptions[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        self._counters[name][_label_set(labels)] += value
+
+    def add(self, name: str, value: float, **labels: str) -> None:
+        """Move a gauge up or down."""
+        self._gauges[name][_label_set(labels)] += value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        self._gauges[name][_label_set(labels)] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = _label_set(labels)
+        series = self._histograms[name].get(key)
+        if series is None:
+            # Per-bucket counts, then sum and count
+            series = self._histograms[name][key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def register_callback(self,
+                          name: str,
+                          kind: str,
+                          help_text: str,
+                          collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]) -> None:
+        """Sample (labels, value) pairs from collect at scrape time, e.g. for queue depths."""
+        self.describe(name, kind, help_text)
+        self._callbacks.append((name, collect))
+
+    def record_call(self, component: str, method: str, seconds: float, error: bool) -> None:
+        endpoint = current_endpoint.get()
+        self.inc("upstream_calls_total", component=component, method=method, endpoint=endpoint)
+        if error:
+            self.inc("upstream_errors_total", component=component, method=method, endpoint=endpoint)
+        self.observe("upstream_call_duration_seconds", seconds, component=component, method=method)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.append((f"{component}.{method}", seconds))
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self._counters.items():
+            lines.extend(self._header(name))
+            lines.extend(f"{name}{_format_labels(key)} {value}" for key, value in series.items())
+        for name, series in self._gauges.items():
+            lines.extend(self._header(name))
+            lines.extend(f"{name}{_format_labels(key)} {value}" for key, value in series.items())
+        for name, series in self._histograms.items():
+            lines.extend(self._header(name))
+            for key, values in series.items():
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, values):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {values[-1]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {values[-2]}")
+                lines.append(f"{name}_count{_format_labels(key)} {values[-1]}")
+        for name, collect in self._callbacks:
+            lines.extend(self._header(name))
+            lines.extend(f"{name}{_format_labels(_label_set(labels))} {value}" for labels, value in collect())
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name: str) -> List[str]:
+        kind, help_text = self._descriptions.get(name, ("untyped", name))
+        return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+def _label_set(labels: Dict[str, str]) -> LabelSet:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key: LabelSet) -> str:
+    if not key:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+def instrument(service: Any, component: str, metrics: Metrics) -> None:
+    """Wrap every public async method of a service instance with timing and call/error counts."""
+    for name, method in inspect.getmembers(type(service), inspect.isfunction):
+        if name.startswith("_"):
+            continue
+        bound = getattr(service, name)
+        if inspect.iscoroutinefunction(method):
+            setattr(service, name, _timed_coroutine(bound, component, name, metrics))
+        elif inspect.isasyncgenfunction(method):
+            setattr(service, name, _timed_generator(bound, component, name, metrics))
+
+def instrument_token_usage(tokens: Any, metrics: Metrics) -> None:
+    """Also count a TokenCounter's recorded usage per endpoint."""
+    record = tokens.record
+
+    @functools.wraps(record)
+    def counted(call_site: str, input_tokens: int, output_tokens: int) -> None:
+        record(call_site, input_tokens, output_tokens)
+        endpoint = current_endpoint.get()
+        metrics.inc("openai_tokens_total", input_tokens, call_type=call_site, direction="input", endpoint=endpoint)
+        metrics.inc("openai_tokens_total", output_tokens, call_type=call_site, direction="output", endpoint=endpoint)
+
+    tokens.record = counted
+
+def _timed_coroutine(method: Callable, component: str, name: str, metrics: Metrics) -> Callable:
+    @functools.wraps(method)
+    async def timed(*args: Any, **kwargs: Any) -> Any:
+        metrics.add("upstream_calls_in_flight", 1, component=component, method=name)
+        start = time.perf_counter()
+        error = False
+        try:
+            return await method(*args, **kwargs)
+        except BaseException:
+            error = True
+            raise
+        finally:
+            metrics.add("upstream_calls_in_flight", -1, component=component, method=name)
+            metrics.record_call(component, name, time.perf_counter() - start, error)
+    return timed
+
+def _timed_generator(method: Callable, component: str, name: str, metrics: Metrics) -> Callable:
+    @functools.wraps(method)
+    async def timed(*args: Any, **kwargs: Any) -> Any:
+        metrics.add("upstream_calls_in_flight", 1, component=component, method=name)
+        start = time.perf_counter()
+        error = False
+        try:
+            async for item in method(*args, **kwargs):
+                yield item
+        except BaseException:
+            error = True
+            raise
+        finally:
+            metrics.add("upstream_calls_in_flight", -1, component=component, method=name)
+            metrics.record_call(component, name, time.perf_counter() - start, error)
+    return timed
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-endpoint request metrics.
+
+    Requests sent with an ``X-Trace: 1`` header get a ``Server-Timing`` response header listing
+    the service calls made before the response started.
+    """
+
+    def __init__(self, app: Any, metrics: Metrics, skip_paths: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.metrics = metrics
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        trace = [] if (b"x-trace", b"1") in scope["headers"] else None
+        endpoint_token = current_endpoint.set(endpoint)
+        trace_token = _current_trace.set(trace)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_metrics(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace is not None:
+                    elapsed = time.perf_counter() - start
+                    timings = [f"{span};dur={seconds * 1000:.1f}" for span, seconds in trace]
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", ", ".join(timings + [f"total;dur={elapsed * 1000:.1f}"])
+                    )
+            await send(message)
+
+        self.metrics.add("http_requests_in_flight", 1, endpoint=endpoint)
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            self.metrics.add("http_requests_in_flight", -1, endpoint=endpoint)
+            self.metrics.observe("http_request_duration_seconds", time.perf_counter() - start, endpoint=endpoint)
+            self.metrics.inc("http_requests_total", endpoint=endpoint, method=scope["method"], status=str(status))
+            current_endpoint.reset(endpoint_token)
+            _current_trace.reset(trace_token)
+
+    @staticmethod
+    def _endpoint(scope: Dict[str, Any]) -> str:
+        # Label by route template so per-user paths do not explode the series count
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
@@ -0,0 +1,144 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import Counter
+from typing import List, Dict, Any, Optional, Callable, Awaitable, TypeVar
+
+from openai import APIConnectionError, APIStatusError, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Lower values are dispatched first when requests are queued behind the rate limits
+PRIORITIES = {"interactive": 0, "background": 1}
+
+class TokenBucket:
+    """Allowance refilled continuously at limit per minute, holding at most one minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken, 0 if available now."""
+        self._refill()
+        amount = min(amount, self.capacity)  # Oversized requests wait for a full bucket
+        return max(amount - self.level, 0) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+class OpenAIScheduler:
+    """Dispatch OpenAI requests by priority within requests- and tokens-per-minute limits, retrying throttled calls."""
+
+    def __init__(self,
+                 requests_per_minute: float = 0,
+                 tokens_per_minute: float = 0,
+                 max_retries: int = 5,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30.0):
+        # A limit of 0 disables that bucket; requests then only go through retry handling
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay  # Backoff ceiling for the first retry, doubled on each attempt
+        self.max_delay = max_delay
+        self.retries: Counter = Counter()  # Reason -> retried attempts
+        self.failures: Counter = Counter()  # Reason -> requests that exhausted their retries
+        self._waiting: List[Any] = []  # Heap of [priority, sequence, tokens, future]
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def queue_depth(self) -> Dict[str, int]:
+        """Requests waiting for rate-limit capacity, by priority class."""
+        depth = {name: 0 for name in PRIORITIES}
+        names = {value: name for name, value in PRIORITIES.items()}
+        for priority, _, _, future in self._waiting:
+            if not future.done():
+                depth[names[priority]] += 1
+        return depth
+
+    async def submit(self,
+                     call: Callable[[], Awaitable[T]],
+                     estimated_tokens: int = 0,
+                     priority: str = "background") -> T:
+        """Run call once capacity is available, retrying rate-limit, server and connection errors."""
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(estimated_tokens, PRIORITIES[priority])
+            try:
+                return await call()
+            except Exception as e:
+                reason = self._retry_reason(e)
+                if reason is None:
+                    raise
+                if attempt == self.max_retries:
+                    self.failures[reason] += 1
+                    raise
+                self.retries[reason] += 1
+                delay = self._backoff(attempt, e)
+                logger.warning("OpenAI request failed (%s), retrying in %.2fs", reason, delay)
+                await asyncio.sleep(delay)
+
+    async def _acquire(self, tokens: int, priority: int) -> None:
+        if self.request_bucket is None and self.token_bucket is None:
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, [priority, next(self._sequence), tokens, future])
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await future
+
+    async def _dispatch(self) -> None:
+        # Only the head of the queue may take capacity, so background work never overtakes a waiting chat
+        while self._waiting:
+            _, _, tokens, future = self._waiting[0]
+            if future.done():  # Caller was cancelled while queued
+                heapq.heappop(self._waiting)
+                continue
+            wait = max(
+                self.request_bucket.wait_time(1) if self.request_bucket else 0,
+                self.token_bucket.wait_time(tokens) if self.token_bucket else 0
+            )
+            if wait > 0:
+                # Re-check afterwards: a higher-priority request may have arrived meanwhile
+                await asyncio.sleep(min(wait, 0.05))
+                continue
+            heapq.heappop(self._waiting)
+            if self.request_bucket:
+                self.request_bucket.take(1)
+            if self.token_bucket:
+                self.token_bucket.take(tokens)
+            future.set_result(None)
+
+    @staticmethod
+    def _retry_reason(error: Exception) -> Optional[str]:
+        if isinstance(error, RateLimitError):
+            return "rate_limit"
+        if isinstance(error, APIStatusError) and error.status_code >= 500:
+            return "server_error"
+        if isinstance(error, APIConnectionError):
+            return "connection"
+        return None
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        # Full jitter spreads retries from concurrent callers; a server-supplied Retry-After wins
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
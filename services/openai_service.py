@@ -1,17 +1,84 @@
+import asyncio
+import json
+import logging
 import os
 from openai import AsyncOpenAI
-from typing import List, Dict, Any, Tuple
-import numpy as np
+from typing import List, Dict, Any, Tuple, Optional, AsyncIterator
+from .embedding_index import ProfileEmbeddingIndex
+from .embedding_batcher import EmbeddingBatcher
+from .llm_cache import LLMCache
+from .openai_scheduler import OpenAIScheduler
+from .token_budget import TokenCounter, compact_profile
+
+logger = logging.getLogger(__name__)
+
+SIMULATION_MODES = ("turn_by_turn", "single_shot")
+# Call types a user is actively waiting on; everything else yields to them under rate limits
+INTERACTIVE_CALL_TYPES = ("chat_response",)
 
 class OpenAIService:
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, client: Optional[AsyncOpenAI] = None):
+        # Retries are handled by the scheduler, which also knows about the rate limits
+        self.client = client or AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self.scheduler = OpenAIScheduler(
+            requests_per_minute=float(os.getenv("OPENAI_RPM", "0")),
+            tokens_per_minute=float(os.getenv("OPENAI_TPM", "0")),
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+        )
         self.model = "gpt-4-turbo-preview"  # Using the latest GPT-4 model
         self.embedding_model = "text-embedding-ada-002"
         self.max_interaction_tokens = 2000  # Maximum tokens for model interactions
+        # Simulation mode per interaction type, e.g. SIMULATION_MODES="networking=single_shot,dating=turn_by_turn"
+        self.default_simulation_mode = os.getenv("SIMULATION_MODE", "turn_by_turn")
+        self.simulation_modes = dict(
+            entry.split("=", 1) for entry in os.getenv("SIMULATION_MODES", "").split(",") if "=" in entry
+        )
+        self.history_token_budget = int(os.getenv("PROMPT_HISTORY_TOKENS", "3000"))  # Conversation tokens per prompt
+        self.tokens = TokenCounter(self.model)
+        self.ranking_batch_size = int(os.getenv("RANKING_BATCH_SIZE", "10"))  # Candidates scored per ranking call
+        self.cache = LLMCache(
+            max_size=int(os.getenv("LLM_CACHE_SIZE", "2048")),
+            path=os.getenv("LLM_CACHE_PATH")
+        )
+        self.embedding_batcher = EmbeddingBatcher(
+            self._create_embeddings,
+            max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "100")),
+            max_wait=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "10")) / 1000
+        )
+
+    async def _complete(self,
+                        call_type: str,
+                        messages: List[Dict[str, str]],
+                        max_tokens: int,
+                        json_response: bool = False) -> str:
+        """Run a chat completion, serving identical requests from the cache."""
+        key = self.cache.make_key(self.model, messages, max_tokens=max_tokens, json_response=json_response)
+        content = self.cache.get(call_type, key)
+        if content is not None:
+            return content
+
+        params = {"response_format": {"type": "json_object"}} if json_response else {}
+        response = await self.scheduler.submit(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                **params
+            ),
+            estimated_tokens=self.tokens.count_messages(messages) + max_tokens,
+            priority="interactive" if call_type in INTERACTIVE_CALL_TYPES else "background"
+        )
+        content = response.choices[0].message.content
+        self.cache.set(call_type, key, content)
+        if response.usage is not None:
+            self.tokens.record(call_type, response.usage.prompt_tokens, response.usage.completion_tokens)
+        else:
+            self.tokens.record(call_type, self.tokens.count_messages(messages), self.tokens.count(content))
+        return content
 
     async def generate_user_description(self, conversation_history: List[Dict[str, str]]) -> str:
         """Generate a user description based on conversation history."""
+        conversation_history = self.tokens.trim_history(conversation_history, self.history_token_budget)
         prompt = f"""Based on the following conversation history, create a detailed description of the user's personality, interests, and communication style. 
         Focus on key traits that would be relevant for social interactions.
         
@@ -20,18 +87,51 @@ class OpenAIService:
         
         Generate a concise but comprehensive description:"""
         
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "system", "content": prompt}],
+        return await self._complete(
+            "user_description",
+            [{"role": "system", "content": prompt}],
             max_tokens=500
         )
-        return response.choices[0].message.content
 
     async def generate_chat_response(self, 
                                    user_description: str, 
                                    other_user_description: str, 
                                    conversation_history: List[Dict[str, str]]) -> str:
         """Generate a chat response considering both users' descriptions."""
+        return await self._complete(
+            "chat_response",
+            self._chat_response_messages(user_description, other_user_description, conversation_history),
+            max_tokens=150
+        )
+
+    async def stream_chat_response(self,
+                                   user_description: str,
+                                   other_user_description: str,
+                                   conversation_history: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """Stream a chat response token by token as the model produces it."""
+        messages = self._chat_response_messages(user_description, other_user_description, conversation_history)
+        stream = await self.scheduler.submit(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=150,
+                stream=True
+            ),
+            estimated_tokens=self.tokens.count_messages(messages) + 150,
+            priority="interactive"
+        )
+        output_tokens = 0
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                output_tokens += self.tokens.count(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        self.tokens.record("chat_response", self.tokens.count_messages(messages), output_tokens)
+
+    def _chat_response_messages(self,
+                                user_description: str,
+                                other_user_description: str,
+                                conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        conversation_history = self.tokens.trim_history(conversation_history, self.history_token_budget)
         prompt = f"""You are having a conversation with another person. Here are the relevant descriptions:
 
         Your description: {user_description}
@@ -42,27 +142,22 @@ class OpenAIService:
 
         Generate a natural, engaging response that matches your personality:"""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "system", "content": prompt}],
-            max_tokens=150
-        )
-        return response.choices[0].message.content
+        return [{"role": "system", "content": prompt}]
 
     async def summarize_conversation(self, conversation_history: List[Dict[str, str]]) -> str:
         """Summarize a conversation for future reference."""
+        conversation_history = self.tokens.trim_history(conversation_history, self.history_token_budget)
         prompt = f"""Summarize the following conversation in a concise paragraph, highlighting key topics discussed and any notable insights or connections made:
 
         {conversation_history}
 
         Summary:"""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "system", "content": prompt}],
+        return await self._complete(
+            "summary",
+            [{"role": "system", "content": prompt}],
             max_tokens=200
         )
-        return response.choices[0].message.content
 
     async def generate_friend_recommendation(self, 
                                           user_description: str, 
@@ -73,36 +168,71 @@ class OpenAIService:
         User Description: {user_description}
 
         Potential Friends:
-        {potential_friends}
+        {[compact_profile(friend) for friend in potential_friends]}
 
         Provide a recommendation with explanation:"""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "system", "content": prompt}],
+        content = await self._complete(
+            "friend_recommendation",
+            [{"role": "system", "content": prompt}],
             max_tokens=300
         )
         return {
-            "recommendation": response.choices[0].message.content,
+            "recommendation": content,
             "confidence_score": 0.85  # This could be made more sophisticated
         }
 
     async def generate_embedding(self, text: str) -> List[float]:
         """Generate an embedding vector for the given text."""
-        response = await self.client.embeddings.create(
-            model=self.embedding_model,
-            input=text
+        return (await self.generate_embeddings([text]))[0]
+
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generate embedding vectors for a list of texts."""
+        # Embeddings are deterministic, so only uncached texts go to the batcher
+        keys = [self.cache.make_key(self.embedding_model, text) for text in texts]
+        embeddings = [self.cache.get("embedding", key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            generated = await self.embedding_batcher.embed_many([texts[i] for i in missing])
+            for i, embedding in zip(missing, generated):
+                self.cache.set("embedding", keys[i], embedding)
+                embeddings[i] = embedding
+        return embeddings
+
+    async def _create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Send one embeddings request for a batch of texts."""
+        response = await self.scheduler.submit(
+            lambda: self.client.embeddings.create(
+                model=self.embedding_model,
+                input=texts
+            ),
+            estimated_tokens=sum(self.tokens.count(text) for text in texts)
         )
-        return response.data[0].embedding
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
     async def simulate_model_interaction(self, 
                                       user1_description: str, 
                                       user2_description: str,
                                       interaction_type: str,
-                                      max_tokens: int = None) -> Tuple[List[Dict[str, str]], str]:
+                                      max_tokens: int = None,
+                                      mode: Optional[str] = None) -> Tuple[List[Dict[str, str]], str]:
         """Simulate an interaction between two user models."""
         if max_tokens is None:
             max_tokens = self.max_interaction_tokens
+        if mode is None:
+            mode = self.simulation_modes.get(interaction_type, self.default_simulation_mode)
+        if mode not in SIMULATION_MODES:
+            raise ValueError(f"Unknown simulation mode: {mode}")
+
+        if mode == "single_shot":
+            result = await self._simulate_single_shot(
+                user1_description,
+                user2_description,
+                interaction_type,
+                max_tokens
+            )
+            if result is not None:
+                return result
 
         conversation = []
         total_tokens = 0
@@ -119,26 +249,26 @@ class OpenAIService:
         Keep responses concise and focused on the interaction type."""
 
         # Start the conversation
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "system", "content": system_prompt}],
+        content = await self._complete(
+            "simulation",
+            [{"role": "system", "content": system_prompt}],
             max_tokens=150
         )
         
         conversation.append({
             "role": "assistant",
-            "content": response.choices[0].message.content
+            "content": content
         })
-        total_tokens += len(response.choices[0].message.content.split())
+        total_tokens += self.tokens.count(content)
 
         # Continue the conversation until max tokens
         while total_tokens < max_tokens:
             # Generate response from user 1
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
+            content = await self._complete(
+                "simulation",
+                [
                     {"role": "system", "content": system_prompt},
-                    *[{"role": msg["role"], "content": msg["content"]} for msg in conversation],
+                    *self.tokens.trim_history(conversation, self.history_token_budget),
                     {"role": "user", "content": "Continue the conversation from Person 1's perspective"}
                 ],
                 max_tokens=150
@@ -146,19 +276,19 @@ class OpenAIService:
             
             conversation.append({
                 "role": "user",
-                "content": response.choices[0].message.content
+                "content": content
             })
-            total_tokens += len(response.choices[0].message.content.split())
+            total_tokens += self.tokens.count(content)
 
             if total_tokens >= max_tokens:
                 break
 
             # Generate response from user 2
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
+            content = await self._complete(
+                "simulation",
+                [
                     {"role": "system", "content": system_prompt},
-                    *[{"role": msg["role"], "content": msg["content"]} for msg in conversation],
+                    *self.tokens.trim_history(conversation, self.history_token_budget),
                     {"role": "user", "content": "Continue the conversation from Person 2's perspective"}
                 ],
                 max_tokens=150
@@ -166,15 +296,56 @@ class OpenAIService:
             
             conversation.append({
                 "role": "assistant",
-                "content": response.choices[0].message.content
+                "content": content
             })
-            total_tokens += len(response.choices[0].message.content.split())
+            total_tokens += self.tokens.count(content)
 
         # Generate summary of the interaction
         summary = await self.summarize_conversation(conversation)
         
         return conversation, summary
 
+    async def _simulate_single_shot(self,
+                                    user1_description: str,
+                                    user2_description: str,
+                                    interaction_type: str,
+                                    max_tokens: int) -> Optional[Tuple[List[Dict[str, str]], str]]:
+        """Generate the whole dialogue and its summary in one structured completion."""
+        prompt = f"""You are simulating an interaction between two people with the following descriptions:
+
+        Person 1: {user1_description}
+        Person 2: {user2_description}
+
+        The interaction type is: {interaction_type}
+
+        Write a natural conversation of about {max_tokens} tokens between these two people, considering their personalities and the interaction type.
+        Alternate speakers and keep each turn concise and focused on the interaction type.
+        Then summarize the conversation in a concise paragraph, highlighting key topics discussed and any notable insights or connections made.
+
+        Respond with a JSON object of the form {{"conversation": [{{"speaker": 1, "content": "..."}}], "summary": "..."}}."""
+
+        content = await self._complete(
+            "simulation",
+            [{"role": "system", "content": prompt}],
+            max_tokens=min(max_tokens + 300, 4096),
+            json_response=True
+        )
+
+        try:
+            result = json.loads(content)
+            conversation = [{
+                "role": "user" if str(turn["speaker"]) == "1" else "assistant",
+                "content": str(turn["content"])
+            } for turn in result["conversation"]]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            logger.warning("Could not parse single-shot simulation, falling back to turn-by-turn")
+            return None
+        if not conversation:
+            return None
+
+        summary = result.get("summary") or await self.summarize_conversation(conversation)
+        return conversation, summary
+
     async def find_best_match(self, 
                             user_description: str,
                             interaction_type: str,
@@ -186,7 +357,7 @@ class OpenAIService:
         Interaction Type: {interaction_type}
 
         Potential Matches:
-        {potential_matches}
+        {[compact_profile(match) for match in potential_matches]}
 
         Consider:
         1. Compatibility of personalities
@@ -196,14 +367,13 @@ class OpenAIService:
 
         Provide a detailed explanation for your choice and a confidence score (0-1)."""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "system", "content": prompt}],
+        content = await self._complete(
+            "best_match",
+            [{"role": "system", "content": prompt}],
             max_tokens=300
         )
 
         # Parse the response to extract the match and confidence score
-        content = response.choices[0].message.content
         confidence_score = 0.85  # Default score, could be made more sophisticated
 
         return {
@@ -211,33 +381,82 @@ class OpenAIService:
             "confidence_score": confidence_score
         }
 
+    async def rank_candidates(self,
+                            user_description: str,
+                            interaction_type: str,
+                            candidates: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Score many candidates per call, returning {user_id: {"score", "reason"}}."""
+        batches = [candidates[start:start + self.ranking_batch_size]
+                   for start in range(0, len(candidates), self.ranking_batch_size)]
+        results = await asyncio.gather(*(
+            self._rank_batch(user_description, interaction_type, batch) for batch in batches
+        ))
+        rankings = {}
+        for result in results:
+            rankings.update(result)
+        return rankings
+
+    async def _rank_batch(self,
+                          user_description: str,
+                          interaction_type: str,
+                          candidates: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        prompt = f"""Score how well each candidate suits the user for the specified interaction type:
+
+        User Description: {user_description}
+        Interaction Type: {interaction_type}
+
+        Candidates:
+        {json.dumps([compact_profile(candidate) for candidate in candidates])}
+
+        Consider:
+        1. Compatibility of personalities
+        2. Relevance to the interaction type
+        3. Potential for meaningful interaction
+        4. Shared interests or complementary traits
+
+        Respond with a JSON object of the form {{"rankings": [{{"user_id": "...", "score": 0.0, "reason": "..."}}]}}
+        with one entry per candidate, where score is between 0 and 1 and reason is one or two sentences."""
+
+        content = await self._complete(
+            "ranking",
+            [{"role": "system", "content": prompt}],
+            max_tokens=80 * len(candidates) + 50,
+            json_response=True
+        )
+
+        candidate_ids = {candidate["user_id"] for candidate in candidates}
+        rankings = {}
+        try:
+            entries = json.loads(content).get("rankings", [])
+        except (json.JSONDecodeError, AttributeError):
+            logger.warning("Could not parse ranking response: %s", content)
+            return rankings
+        for entry in entries:
+            try:
+                user_id = str(entry["user_id"])
+                score = min(max(float(entry["score"]), 0.0), 1.0)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if user_id in candidate_ids:
+                rankings[user_id] = {"score": score, "reason": str(entry.get("reason", ""))}
+        return rankings
+
     async def find_embedding_matches(self,
                                    user_embedding: List[float],
                                    interaction_type: str,
                                    potential_matches: List[Dict[str, Any]],
-                                   top_k: int = 5) -> List[Dict[str, Any]]:
+                                   top_k: int = 5,
+                                   index: Optional[ProfileEmbeddingIndex] = None) -> List[Dict[str, Any]]:
         """Find matches based on embedding similarity."""
-        matches = []
-        
-        for match in potential_matches:
-            match_embedding = match["profile_data"]["description_embedding"]
-            
-            # Calculate cosine similarity
-            similarity = self._cosine_similarity(user_embedding, match_embedding)
-            
-            matches.append({
-                "user_id": match["user_id"],
-                "profile": match,
-                "similarity_score": similarity,
-                "interaction_type": interaction_type
-            })
+        # Score every candidate in one matrix-vector product, reusing a shared index when given
+        if index is None:
+            index = ProfileEmbeddingIndex.from_profiles(potential_matches)
+        profiles_by_id = {match["user_id"]: match for match in potential_matches}
         
-        # Sort by similarity score and return top k
-        matches.sort(key=lambda x: x["similarity_score"], reverse=True)
-        return matches[:top_k]
-
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calculate cosine similarity between two vectors."""
-        vec1 = np.array(vec1)
-        vec2 = np.array(vec2)
-        return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2)) 
\ No newline at end of file
+        return [{
+            "user_id": user_id,
+            "profile": profiles_by_id[user_id],
+            "similarity_score": similarity,
+            "interaction_type": interaction_type
+        } for user_id, similarity in index.search(user_embedding, top_k, candidate_ids=profiles_by_id)]
+ 
\ No newline at end of file
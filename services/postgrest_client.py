@@ -0,0 +1,35 @@
+from typing import Dict, Optional
+from httpx import AsyncBaseTransport, AsyncClient, Limits, Timeout
+from postgrest import AsyncPostgrestClient
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """Async PostgREST client whose requests share one pooled keep-alive HTTP session."""
+
+    def __init__(self,
+                 supabase_url: str,
+                 supabase_key: str,
+                 timeout: float = 10.0,
+                 max_connections: int = 20,
+                 max_keepalive_connections: int = 10,
+                 http2: bool = False,
+                 transport: Optional[AsyncBaseTransport] = None):
+        # Read by create_session, which the base constructor calls
+        self._session_options = {
+            "limits": Limits(max_connections=max_connections,
+                             max_keepalive_connections=max_keepalive_connections),
+            "http2": http2,  # Requires the h2 package (pip install httpx[http2])
+            "transport": transport
+        }
+        super().__init__(
+            f"{supabase_url}/rest/v1",
+            headers={"apiKey": supabase_key, "Authorization": f"Bearer {supabase_key}"},
+            timeout=Timeout(timeout)
+        )
+
+    def create_session(self,
+                       base_url: str,
+                       headers: Dict[str, str],
+                       timeout: Timeout,
+                       verify: bool = True) -> AsyncClient:
+        return AsyncClient(base_url=base_url, headers=headers, timeout=timeout, verify=verify,
+                           **self._session_options)
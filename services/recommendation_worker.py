@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from datetime import timedelta
+from typing import List, Set, Tuple
+from .friend_recommendation import FriendRecommendationService
+from .supabase_service import SupabaseService
+
+logger = logging.getLogger(__name__)
+
+class RecommendationPrecomputeWorker:
+    """Refresh stored friend recommendations in the background so requests can be served from the table."""
+
+    def __init__(self,
+                 recommendation_service: FriendRecommendationService,
+                 supabase_service: SupabaseService,
+                 refresh_interval: float = 3600,
+                 concurrency: int = 2):
+        self.recommendation_service = recommendation_service
+        self.supabase_service = supabase_service
+        self.refresh_interval = refresh_interval  # Seconds between full refreshes, 0 disables them
+        self.concurrency = concurrency
+        self._queue: "asyncio.Queue[Tuple[str, bool]]" = asyncio.Queue()
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        supabase_service.profile_listeners.append(self.mark_dirty)
+
+    def mark_dirty(self, user_id: str) -> None:
+        """Recompute a user's recommendations, e.g. after their profile changed."""
+        self.recommendation_service.invalidate(user_id)
+        self._enqueue(user_id, force=True)
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        if self.refresh_interval > 0:
+            self._tasks.append(asyncio.create_task(self._schedule()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _enqueue(self, user_id: str, force: bool) -> None:
+        if user_id in self._queued:
+            return
+        self._queued.add(user_id)
+        self._queue.put_nowait((user_id, force))
+
+    async def _schedule(self) -> None:
+        while True:
+            try:
+                for user_id in await self.supabase_service.get_all_user_ids():
+                    self._enqueue(user_id, force=False)
+            except Exception:
+                logger.exception("Failed to schedule recommendation refresh")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def _consume(self) -> None:
+        # Refresh users whose stored recommendations are past half the freshness window
+        max_age = self.recommendation_service.freshness / 2
+        while True:
+            user_id, force = await self._queue.get()
+            self._queued.discard(user_id)
+            try:
+                await self._refresh(user_id, force, max_age)
+            except Exception:
+                logger.exception("Failed to precompute recommendations for %s", user_id)
+            finally:
+                self._queue.task_done()
+
+    async def _refresh(self, user_id: str, force: bool, max_age: timedelta) -> None:
+        if not force and (self.recommendation_service.known_empty(user_id, max_age)
+                          or await self.recommendation_service.get_stored_recommendations(user_id, max_age)):
+            return
+        await self.recommendation_service.compute_recommendations(user_id)
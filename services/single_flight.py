@@ -0,0 +1,48 @@
+import asyncio
+from typing import Dict, Hashable, Callable, Awaitable, TypeVar
+from .cache import TTLCache
+
+T = TypeVar("T")
+
+_NO_RESULT = object()
+
+class SingleFlight:
+    """Run one computation per key at a time, sharing its result with every concurrent caller."""
+
+    def __init__(self, retention: float = 0, max_results: int = 1024):
+        self.retention = retention  # Seconds a finished result keeps being served, 0 to share only in-flight work
+        self.results = TTLCache(max_results, retention)
+        self.started = 0  # Computations actually run
+        self.shared = 0  # Calls answered by another caller's computation or a retained result
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[T]]) -> T:
+        if self.retention > 0:
+            result = self.results.get(key, _NO_RESULT)
+            if result is not _NO_RESULT:
+                self.shared += 1
+                return result
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.started += 1
+        else:
+            self.shared += 1
+        # A caller that disconnects must not cancel the computation the others are waiting on
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable) -> None:
+        """Drop a retained result so the next call recomputes it."""
+        self.results.delete(key)
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if self.retention > 0 and not task.cancelled() and task.exception() is None:
+            self.results.set(key, task.result())
@@ -1,14 +1,281 @@
+import asyncio
+import base64
+import binascii
+import json
+import logging
 import os
-from supabase import create_client, Client
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Iterable, Tuple
 import numpy as np
+from .embedding_index import ProfileEmbeddingIndex
+from .embedding_store import EmbeddingStore
+from .cache import TTLCache
+from .write_buffer import WriteBehindBuffer
+from .interaction_index import InteractionIndex
+from .postgrest_client import PooledPostgrestClient
+from .candidate_index import CandidateIndex
+from .interaction_graph import InteractionGraph
+
+logger = logging.getLogger(__name__)
+
+_MISSING_PROFILE = object()  # Negative cache entry for user_ids without a profile
+
+# Columns a client may request from interactions; the defaults leave out the bulky ones
+INTERACTION_FIELDS = ("id", "user1_id", "user2_id", "interaction_type", "group_id",
+                      "summary", "conversation", "embedding", "timestamp")
+DEFAULT_INTERACTION_FIELDS = ("id", "user1_id", "user2_id", "interaction_type", "group_id", "summary", "timestamp")
+# profile_data keys returned for friends unless others are requested
+DEFAULT_FRIEND_PROFILE_FIELDS = ("description", "interests", "groups")
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """Opaque page cursor for a keyset position."""
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, key: str) -> Any:
+    """Read one keyset value back out of a cursor made by encode_cursor."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(position, dict) or key not in position:
+        raise ValueError("Invalid cursor")
+    return position[key]
 
 class SupabaseService:
-    def __init__(self):
-        self.supabase: Client = create_client(
+    def __init__(self, client: Optional[PooledPostgrestClient] = None):
+        # One pooled async HTTP session is shared by every query
+        self.supabase = client or PooledPostgrestClient(
             os.getenv("SUPABASE_URL"),
-            os.getenv("SUPABASE_KEY")
+            os.getenv("SUPABASE_KEY"),
+            timeout=float(os.getenv("SUPABASE_TIMEOUT", "10")),
+            max_connections=int(os.getenv("SUPABASE_POOL_SIZE", "20")),
+            max_keepalive_connections=int(os.getenv("SUPABASE_KEEPALIVE_CONNECTIONS", "10")),
+            http2=os.getenv("SUPABASE_HTTP2", "false").lower() == "true"
         )
+        store_path = os.getenv("PROFILE_EMBEDDING_STORE")
+        self.profile_index = ProfileEmbeddingIndex(store=EmbeddingStore(
+            store_path,
+            dtype=os.getenv("PROFILE_EMBEDDING_DTYPE", "float16"),
+            readonly=os.getenv("PROFILE_EMBEDDING_STORE_READONLY", "false").lower() == "true"
+        ) if store_path else None)
+        self.interaction_index = InteractionIndex(path=os.getenv("INTERACTION_INDEX_PATH"))
+        self.candidate_index = CandidateIndex()
+        self.candidate_index_ready = False  # Set once every profile is indexed; until then queries hit the table
+        self.interaction_graph = InteractionGraph()  # Who has talked or interacted with whom
+        self.profile_cache = TTLCache(
+            max_size=int(os.getenv("PROFILE_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("PROFILE_CACHE_TTL", "300"))
+        )
+        self.missing_profile_ttl = 30  # Seconds to remember that a profile does not exist
+        self.profile_listeners: List[Callable[[str], None]] = []  # Called with the user_id after each profile update
+        write_batch_size = int(os.getenv("WRITE_BUFFER_BATCH_SIZE", "100"))
+        write_flush_interval = float(os.getenv("WRITE_BUFFER_FLUSH_MS", "1000")) / 1000
+        # Interactions are indexed once inserted, so the index holds their database ids
+        self.interaction_writer = WriteBehindBuffer(
+            "interactions", self._insert_rows, write_batch_size, write_flush_interval,
+            on_written=self._index_interactions
+        )
+        self.recommendation_writer = WriteBehindBuffer(
+            "friend_recommendations", self._insert_rows, write_batch_size, write_flush_interval
+        )
+        self.snapshot_interval = float(os.getenv("INDEX_SNAPSHOT_SECONDS", "300"))  # 0 saves only on shutdown
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._maintenance_task: Optional[asyncio.Task] = None  # Rebuilds interaction index partitions
+
+    async def _insert_rows(self, table: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        response = await self.supabase.table(table).insert(rows).execute()
+        return response.data
+
+    def _index_interactions(self, rows: List[Dict[str, Any]]) -> None:
+        for row in rows:
+            self.interaction_index.add(row)
+        if self.interaction_index.due():
+            self.maintain_interaction_index()
+
+    def start_snapshots(self) -> None:
+        """Persist changed local indexes every snapshot_interval seconds, so a crash loses little."""
+        if self.snapshot_interval > 0:
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+
+    async def _snapshot_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.snapshot_indexes()
+            except Exception:
+                logger.exception("Failed to snapshot indexes")
+
+    async def snapshot_indexes(self) -> None:
+        """Save the interaction index and profile embedding store if they changed since the last save."""
+        if self.interaction_index.path and self.interaction_index.changes:
+            # Copy on the event loop, where the index is mutated; write the copy from a thread
+            snapshot = self.interaction_index.snapshot()
+            await asyncio.to_thread(self.interaction_index.write, snapshot)
+        await self.sync_profile_store()
+        if self.profile_index.store.changes:
+            # Read-only workers sharing the store pick the new rows up on their next refresh()
+            self.profile_index.store.flush()
+
+    async def sync_profile_store(self, page_size: int = 1000) -> None:
+        """Re-read profiles updated since the persisted store's last sync, e.g. by read-only workers."""
+        store = self.profile_index.store
+        synced_at = store.metadata.get("synced_at")
+        if not store.path or store.readonly or synced_at is None:
+            return
+        latest = synced_at
+        offset = 0
+        while True:
+            response = await self.supabase.table("user_profiles")\
+                .select("*")\
+                .gt("updated_at", synced_at)\
+                .order("updated_at")\
+                .limit(page_size)\
+                .offset(offset)\
+                .execute()
+            for profile in response.data:
+                self.profile_index.upsert_profile(profile)
+                self.candidate_index.upsert_profile(profile["user_id"], profile["profile_data"] or {})
+                latest = max(latest, profile["updated_at"])
+            if len(response.data) < page_size:
+                break
+            offset += page_size
+        store.metadata["synced_at"] = latest
+
+    async def close(self) -> None:
+        """Flush buffered writes and indexes, then close the HTTP connection pool."""
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+        await self.interaction_writer.close()
+        await self.recommendation_writer.close()
+        self.interaction_index.save()
+        self.profile_index.store.flush()
+        await self.supabase.aclose()
+
+    async def load_profile_index(self, page_size: int = 1000) -> None:
+        """Populate the profile embedding and candidate indexes from all stored profiles."""
+        store = self.profile_index.store
+        store.refresh()  # A read-only worker may have opened the store before its writer first flushed
+        # A persisted embedding store already holds the vectors, so only memberships are fetched, plus
+        # full rows for profiles added or updated since the store was last synced
+        synced_at = store.metadata.get("synced_at") if len(store) else None
+        columns = "user_id, updated_at, groups:profile_data->groups, "\
+            "interaction_types:profile_data->interaction_types" if synced_at else "*"
+        seen, changed = set(), []
+        latest = synced_at
+        offset = 0
+        while True:
+            response = await self.supabase.table("user_profiles")\
+                .select(columns)\
+                .order("user_id")\
+                .limit(page_size)\
+                .offset(offset)\
+                .execute()
+            for profile in response.data:
+                user_id, updated_at = profile["user_id"], profile.get("updated_at")
+                seen.add(user_id)
+                if updated_at and (latest is None or updated_at > latest):
+                    latest = updated_at
+                if columns == "*":
+                    self.profile_index.upsert_profile(profile)
+                    self.candidate_index.upsert_profile(user_id, profile["profile_data"] or {})
+                    continue
+                self.profile_index.set_groups(user_id, profile["groups"] or [])
+                self.candidate_index.upsert_profile(user_id, profile)
+                # Rows without a timestamp can only be judged by whether the store has them
+                if updated_at > synced_at if updated_at else user_id not in store:
+                    changed.append(user_id)
+            if len(response.data) < page_size:
+                break
+            offset += page_size
+
+        if not store.readonly:
+            for profile in (await self.get_user_profiles(changed)).values():
+                self.profile_index.upsert_profile(profile)
+            for user_id in [user_id for user_id in store.ids if user_id not in seen]:
+                self.profile_index.delete(user_id)
+            store.metadata["synced_at"] = latest
+            store.flush()
+        self.candidate_index_ready = True
+
+    async def load_interaction_index(self, page_size: int = 1000, batch_size: int = 100) -> None:
+        """Load the interaction index from disk and add rows missing from it, or rebuild it."""
+        columns = "id, user1_id, user2_id, interaction_type, group_id, summary, embedding"
+        if self.interaction_index.load():
+            # Concurrent insert batches can finish out of id order, and other workers insert too, so
+            # rows below the snapshot's highest id may still be missing: compare the id sets
+            missing = []
+            after = None
+            while True:
+                query = self.supabase.table("interactions")\
+                    .select("id")\
+                    .not_.is_("embedding", "null")
+                if after is not None:
+                    query = query.gt("id", after)
+                response = await query.order("id").limit(page_size).execute()
+                missing.extend(row["id"] for row in response.data if row["id"] not in self.interaction_index)
+                if len(response.data) < page_size:
+                    break
+                after = response.data[-1]["id"]
+            for start in range(0, len(missing), batch_size):
+                response = await self.supabase.table("interactions")\
+                    .select(columns)\
+                    .in_("id", missing[start:start + batch_size])\
+                    .execute()
+                for interaction in response.data:
+                    self.interaction_index.add(interaction)
+        else:
+            after = None
+            while True:
+                query = self.supabase.table("interactions").select(columns)
+                if after is not None:
+                    query = query.gt("id", after)
+                response = await query.order("id").limit(page_size).execute()
+                for interaction in response.data:
+                    self.interaction_index.add(interaction)
+                if len(response.data) < page_size:
+                    break
+                after = response.data[-1]["id"]
+        await self.maintain_interaction_index()
+
+    def maintain_interaction_index(self) -> asyncio.Task:
+        """Retrain or re-pack grown interaction index partitions off the event loop, one task at a time."""
+        if self._maintenance_task is None or self._maintenance_task.done():
+            self._maintenance_task = asyncio.create_task(self._rebuild_partitions())
+        return self._maintenance_task
+
+    async def _rebuild_partitions(self) -> None:
+        try:
+            while True:
+                due = self.interaction_index.due()
+                if not due:
+                    return
+                for key in due:
+                    # k-means and the re-pack run on a copy in a thread; add() keeps appending meanwhile
+                    rebuilt = await asyncio.to_thread(self.interaction_index.rebuild(key))
+                    self.interaction_index.swap(key, rebuilt)
+        except Exception:
+            # Partitions keep serving exact or tail scans; the next write retries
+            logger.exception("Failed to rebuild interaction index partitions")
+
+    async def load_interaction_graph(self, page_size: int = 1000) -> None:
+        """Build the interaction graph from the conversations and interactions tables."""
+        pairs = []
+        for table, columns in (("conversations", ("user_id", "other_user_id")),
+                               ("interactions", ("user1_id", "user2_id"))):
+            offset = 0
+            while True:
+                response = await self.supabase.table(table)\
+                    .select(", ".join(columns))\
+                    .order("id")\
+                    .limit(page_size)\
+                    .offset(offset)\
+                    .execute()
+                pairs.extend((row[columns[0]], row[columns[1]]) for row in response.data)
+                if len(response.data) < page_size:
+                    break
+                offset += page_size
+        self.interaction_graph.add_edges(pairs)
 
     async def update_user_profile(self, user_id: str, profile_data: Dict[str, Any]) -> None:
         """Update or create a user profile."""
@@ -17,20 +284,38 @@ class SupabaseService:
             "profile_data": profile_data
         }
         await self.supabase.table("user_profiles").upsert(data).execute()
+        self.profile_cache.delete(user_id)
+        self.profile_index.upsert_profile(data)
+        self.candidate_index.upsert_profile(user_id, profile_data)
+        for listener in self.profile_listeners:
+            listener(user_id)
 
     async def get_user_profile(self, user_id: str) -> Dict[str, Any]:
         """Get a user's profile."""
+        cached = self.profile_cache.get(user_id)
+        if cached is _MISSING_PROFILE:
+            raise Exception("User profile not found")
+        if cached is not None:
+            return self._copy_profile(cached)
+
         response = await self.supabase.table("user_profiles").select("*").eq("user_id", user_id).execute()
         if not response.data:
+            self.profile_cache.set(user_id, _MISSING_PROFILE, self.missing_profile_ttl)
             raise Exception("User profile not found")
-        return response.data[0]
+        self.profile_cache.set(user_id, response.data[0])
+        return self._copy_profile(response.data[0])
+
+    @staticmethod
+    def _copy_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+        # Callers edit profile_data in place, so never hand out the cached dicts
+        return {**profile, "profile_data": dict(profile["profile_data"] or {})}
 
     async def save_conversation(self, 
                               user_id: str, 
                               other_user_id: str, 
                               messages: List[Dict[str, str]], 
-                              summary: str) -> None:
-        """Save a conversation and its summary."""
+                              summary: Optional[str] = None) -> None:
+        """Save a conversation and its summary (None for a chunk of messages saved between summaries)."""
         data = {
             "user_id": user_id,
             "other_user_id": other_user_id,
@@ -39,66 +324,233 @@ class SupabaseService:
             "timestamp": "now()"
         }
         await self.supabase.table("conversations").insert(data).execute()
+        self.interaction_graph.add_edge(user_id, other_user_id)
+
+    async def get_user_profiles(self, user_ids: List[str], batch_size: int = 100) -> Dict[str, Dict[str, Any]]:
+        """Get several users' profiles keyed by user_id, one query per batch of ids."""
+        profiles = {}
+        uncached_ids = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = self.profile_cache.get(user_id)
+            if cached is None:
+                uncached_ids.append(user_id)
+            elif cached is not _MISSING_PROFILE:
+                profiles[user_id] = self._copy_profile(cached)
+
+        for start in range(0, len(uncached_ids), batch_size):
+            batch = uncached_ids[start:start + batch_size]
+            response = await self.supabase.table("user_profiles")\
+                .select("*")\
+                .in_("user_id", batch)\
+                .execute()
+            for profile in response.data:
+                self.profile_cache.set(profile["user_id"], profile)
+                profiles[profile["user_id"]] = self._copy_profile(profile)
+            for user_id in batch:
+                if user_id not in profiles:
+                    self.profile_cache.set(user_id, _MISSING_PROFILE, self.missing_profile_ttl)
+        return profiles
+
+    async def search_potential_matches(self,
+                                     user_id: str,
+                                     embedding: List[float],
+                                     interaction_type: str,
+                                     group_id: Optional[str] = None,
+                                     limit: int = 200) -> List[Tuple[Dict[str, Any], float]]:
+        """Get the potential matches with the most similar profile embeddings, with their similarity."""
+        results = self.search_similar_users(user_id, embedding, interaction_type, group_id, limit)
+        profiles = await self.get_user_profiles([match_id for match_id, _ in results])
+        return [(profiles[match_id], similarity) for match_id, similarity in results if match_id in profiles]
+
+    def search_similar_users(self,
+                             user_id: str,
+                             embedding: List[float],
+                             interaction_type: str,
+                             group_id: Optional[str] = None,
+                             limit: int = 200) -> List[Tuple[str, float]]:
+        """Ids of the users not yet interacted with whose profile embeddings are most similar, best first."""
+        candidate_ids = None
+        if self.candidate_index_ready:
+            candidate_ids = self.candidate_index.candidates(group_id, interaction_type)
+        return self.profile_index.search(
+            embedding,
+            limit,
+            group_id=group_id,
+            candidate_ids=candidate_ids,
+            exclude_ids=self._interacted_with(user_id)
+        )
+
+    def profile_similarities(self, embedding: List[float], user_ids: List[str]) -> np.ndarray:
+        """Cosine similarity of each user's profile embedding to embedding, 0 for users without one."""
+        similarities = np.zeros(len(user_ids), dtype=np.float32)
+        indexed = [i for i, other_id in enumerate(user_ids) if other_id in self.profile_index]
+        if indexed:
+            similarities[indexed] = self.profile_index.scores(embedding, [user_ids[i] for i in indexed])
+        return similarities
+
+    async def _profiles_in_order(self, user_ids: List[str]) -> List[Dict[str, Any]]:
+        profiles = await self.get_user_profiles(user_ids)
+        return [profiles[user_id] for user_id in user_ids if user_id in profiles]
+
+    async def get_user_friends(self,
+                             user_id: str,
+                             limit: int = 50,
+                             cursor: Optional[str] = None,
+                             fields: Optional[Iterable[str]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get one page of a user's friends, ordered by friend id, with their latest conversation summaries.
+
+        Returns the page and a cursor for the next one (None on the last page). Friend profiles
+        only carry the requested profile_data fields.
+        """
+        after = decode_cursor(cursor, "after") if cursor else None
+        fields = tuple(fields or DEFAULT_FRIEND_PROFILE_FIELDS)
+
+        # Rows come grouped by friend, newest first, so the first summarized row per friend is their
+        # latest summary; each chunk resumes after the last friend seen, skipping their older rows
+        summaries: Dict[str, Optional[str]] = {}
+        chunk_size = 4 * (limit + 1)
+        while len(summaries) <= limit:
+            query = self.supabase.table("conversations")\
+                .select("other_user_id, summary")\
+                .eq("user_id", user_id)
+            if after is not None:
+                query = query.gt("other_user_id", after)
+            response = await query.order("other_user_id,timestamp.desc").limit(chunk_size).execute()
+            for conv in response.data:
+                if not summaries.get(conv["other_user_id"]):
+                    summaries[conv["other_user_id"]] = conv["summary"]
+            if len(response.data) < chunk_size:
+                break
+            after = response.data[-1]["other_user_id"]
+
+        friend_ids = list(summaries)[:limit + 1]
+        next_cursor = encode_cursor({"after": friend_ids[limit - 1]}) if len(friend_ids) > limit else None
+        friend_ids = friend_ids[:limit]
+
+        # Message chunks saved between summaries carry none; look further back for friends whose
+        # summarized rows were not among the rows read above
+        unsummarized = [friend_id for friend_id in friend_ids if not summaries[friend_id]]
+        if unsummarized:
+            response = await self.supabase.table("conversations")\
+                .select("other_user_id, summary")\
+                .eq("user_id", user_id)\
+                .in_("other_user_id", unsummarized)\
+                .not_.is_("summary", "null")\
+                .neq("summary", "")\
+                .order("other_user_id,timestamp.desc")\
+                .limit(4 * len(unsummarized))\
+                .execute()
+            for conv in response.data:
+                if not summaries[conv["other_user_id"]]:
+                    summaries[conv["other_user_id"]] = conv["summary"]
+
+        profiles = await self.get_user_profiles(friend_ids)
 
-    async def get_user_friends(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get a user's friends list with their latest conversation summaries."""
-        response = await self.supabase.table("conversations")\
-            .select("other_user_id, summary")\
-            .eq("user_id", user_id)\
-            .order("timestamp", desc=True)\
-            .execute()
-        
         friends = []
-        for conv in response.data:
-            friend_profile = await self.get_user_profile(conv["other_user_id"])
+        for friend_id in friend_ids:
+            if friend_id not in profiles:
+                continue
+            profile_data = profiles[friend_id]["profile_data"]
             friends.append({
-                "user_id": conv["other_user_id"],
-                "profile": friend_profile,
-                "last_conversation_summary": conv["summary"]
+                "user_id": friend_id,
+                "profile": {
+                    "user_id": friend_id,
+                    "profile_data": {field: profile_data[field] for field in fields if field in profile_data}
+                },
+                "last_conversation_summary": summaries[friend_id]
             })
-        return friends
+        return friends, next_cursor
 
     async def get_potential_friends(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get potential friends for recommendations."""
+        """Get potential friends for recommendations, friends of friends first."""
+        excluded = self._interacted_with(user_id)
+        friends_of_friends = [other_id for other_id, _ in self.interaction_graph.friends_of_friends(user_id, limit)]
+        if len(friends_of_friends) == limit:
+            return await self._profiles_in_order(friends_of_friends)
+        excluded.extend(friends_of_friends)
+        if self.candidate_index_ready:
+            return await self._profiles_in_order(friends_of_friends + self.candidate_index.candidates(
+                exclude_ids=excluded,
+                limit=limit - len(friends_of_friends)
+            ))
+
         # Get users who haven't interacted with the current user
         response = await self.supabase.table("user_profiles")\
             .select("*")\
             .neq("user_id", user_id)\
-            .limit(limit)\
+            .limit(limit + len(excluded))\
             .execute()
         
-        return response.data
+        others = self._without(response.data, excluded)[:limit - len(friends_of_friends)]
+        return await self._profiles_in_order(friends_of_friends) + others
 
     async def save_friend_recommendation(self, 
                                        user_id: str, 
                                        recommended_user_id: str, 
                                        recommendation_data: Dict[str, Any]) -> None:
-        """Save a friend recommendation."""
+        """Queue a friend recommendation for the next batched insert."""
         data = {
             "user_id": user_id,
             "recommended_user_id": recommended_user_id,
             "recommendation_data": recommendation_data,
             "timestamp": "now()"
         }
-        await self.supabase.table("friend_recommendations").insert(data).execute()
+        self.recommendation_writer.add(data)
+
+    async def get_friend_recommendations(self,
+                                       user_id: str,
+                                       since: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get stored friend recommendations for a user, newest first."""
+        query = self.supabase.table("friend_recommendations")\
+            .select("recommended_user_id, recommendation_data, timestamp")\
+            .eq("user_id", user_id)
+        
+        if since:
+            query = query.gte("timestamp", since)
+        
+        response = await query.order("timestamp", desc=True).execute()
+        return response.data
+
+    async def get_all_user_ids(self, page_size: int = 1000) -> List[str]:
+        """Get the ids of every user with a profile."""
+        user_ids = []
+        offset = 0
+        while True:
+            response = await self.supabase.table("user_profiles")\
+                .select("user_id")\
+                .order("user_id")\
+                .limit(page_size)\
+                .offset(offset)\
+                .execute()
+            user_ids.extend(row["user_id"] for row in response.data)
+            if len(response.data) < page_size:
+                break
+            offset += page_size
+        return user_ids
 
     async def get_conversation_history(self, 
                                      user_id: str, 
                                      other_user_id: str, 
                                      limit: int = 50) -> List[Dict[str, str]]:
-        """Get conversation history between two users."""
+        """Get conversation history between two users, oldest message first."""
+        messages = []
+        for conv in await self.get_conversation_rows(user_id, other_user_id, limit):
+            messages.extend(conv["messages"])
+        return messages
+
+    async def get_conversation_rows(self,
+                                  user_id: str,
+                                  other_user_id: str,
+                                  limit: int = 50) -> List[Dict[str, Any]]:
+        """Get the newest stored conversation rows between two users, oldest first, with their summaries."""
         response = await self.supabase.table("conversations")\
-            .select("messages")\
+            .select("messages, summary")\
             .or_(f"user_id.eq.{user_id},other_user_id.eq.{user_id}")\
             .or_(f"user_id.eq.{other_user_id},other_user_id.eq.{other_user_id}")\
             .order("timestamp", desc=True)\
             .limit(limit)\
             .execute()
-        
-        messages = []
-        for conv in response.data:
-            messages.extend(conv["messages"])
-        return messages
+        return response.data[::-1]
 
     async def save_interaction(self,
                              user1_id: str,
@@ -108,7 +560,7 @@ class SupabaseService:
                              summary: str,
                              embedding: List[float],
                              group_id: Optional[str] = None) -> None:
-        """Save an interaction between two users."""
+        """Queue an interaction between two users for the next batched insert; it becomes searchable once inserted."""
         data = {
             "user1_id": user1_id,
             "user2_id": user2_id,
@@ -119,43 +571,50 @@ class SupabaseService:
             "group_id": group_id,
             "timestamp": "now()"
         }
-        await self.supabase.table("interactions").insert(data).execute()
+        self.interaction_writer.add(data)
+        self.interaction_graph.add_edge(user1_id, user2_id)
 
     async def find_similar_interactions(self,
                                       embedding: List[float],
                                       interaction_type: str,
                                       group_id: Optional[str] = None,
                                       limit: int = 5) -> List[Dict[str, Any]]:
-        """Find similar interactions using vector similarity search."""
-        query = self.supabase.table("interactions")\
-            .select("*")\
-            .eq("interaction_type", interaction_type)\
-            .order("embedding <=> :embedding")\
-            .limit(limit)
-        
-        if group_id:
-            query = query.eq("group_id", group_id)
-        
-        response = await query.execute()
-        return response.data
+        """Find similar interactions using the local approximate nearest-neighbour index."""
+        return self.interaction_index.search(embedding, interaction_type, group_id, limit)
 
     async def get_user_interactions(self,
                                   user_id: str,
                                   interaction_type: Optional[str] = None,
                                   group_id: Optional[str] = None,
-                                  limit: int = 10) -> List[Dict[str, Any]]:
-        """Get a user's interactions."""
+                                  limit: int = 10,
+                                  cursor: Optional[str] = None,
+                                  fields: Optional[Iterable[str]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get one page of a user's interactions, newest first, and the cursor for the next page."""
+        fields = tuple(fields or DEFAULT_INTERACTION_FIELDS)
+        unknown = set(fields) - set(INTERACTION_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown interaction fields: {', '.join(sorted(unknown))}")
+        columns = ", ".join(dict.fromkeys(("id", *fields)))  # id is the keyset column
+
         query = self.supabase.table("interactions")\
-            .select("*")\
+            .select(columns)\
             .or_(f"user1_id.eq.{user_id},user2_id.eq.{user_id}")
         
         if interaction_type:
             query = query.eq("interaction_type", interaction_type)
         if group_id:
             query = query.eq("group_id", group_id)
+        if cursor:
+            # Ids grow with insertion order, so they page newest-first without ties
+            query = query.lt("id", decode_cursor(cursor, "before"))
         
-        response = await query.order("timestamp", desc=True).limit(limit).execute()
-        return response.data
+        response = await query.order("id", desc=True).limit(limit + 1).execute()
+        rows = response.data[:limit]
+        next_cursor = encode_cursor({"before": rows[-1]["id"]}) if len(response.data) > limit else None
+        if "id" not in fields:
+            for row in rows:
+                del row["id"]
+        return rows, next_cursor
 
     async def get_potential_matches(self,
                                   user_id: str,
@@ -163,6 +622,15 @@ class SupabaseService:
                                   group_id: Optional[str] = None,
                                   limit: int = 10) -> List[Dict[str, Any]]:
         """Get potential matches for a user."""
+        excluded = self._interacted_with(user_id)
+        if self.candidate_index_ready:
+            return await self._profiles_in_order(self.candidate_index.candidates(
+                group_id,
+                interaction_type,
+                exclude_ids=excluded,
+                limit=limit
+            ))
+
         # Get users who haven't interacted with the current user
         query = self.supabase.table("user_profiles")\
             .select("*")\
@@ -171,5 +639,15 @@ class SupabaseService:
         if group_id:
             query = query.contains("profile_data->groups", [group_id])
         
-        response = await query.limit(limit).execute()
-        return response.data 
\ No newline at end of file
+        # Over-fetch by the known partners, which are dropped here rather than listed in the URL
+        response = await query.limit(limit + len(excluded)).execute()
+        return self._without(response.data, excluded)[:limit]
+
+    def _interacted_with(self, user_id: str) -> List[str]:
+        """The user and everyone they have talked or interacted with, to leave out of candidates."""
+        return [user_id, *self.interaction_graph.neighbors(user_id)]
+
+    @staticmethod
+    def _without(profiles: List[Dict[str, Any]], user_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        user_ids = set(user_ids)
+        return [profile for profile in profiles if profile["user_id"] not in user_ids] 
\ No newline at end of file
@@ -0,0 +1,85 @@
+import logging
+import math
+from collections import defaultdict
+from typing import List, Dict, Any, Iterable
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character-based estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Profile fields worth sending to the model; embeddings and bookkeeping fields are dropped
+PROMPT_PROFILE_FIELDS = ("description", "interests", "groups")
+_PROFILE_ROW_COLUMNS = ("id", "profile_data", "created_at", "updated_at")
+
+def compact_profile(profile: Dict[str, Any], fields: Iterable[str] = PROMPT_PROFILE_FIELDS) -> Dict[str, Any]:
+    """Reduce a user_profiles row to the fields a prompt needs, keeping any extra context attached to it."""
+    profile_data = profile.get("profile_data") or {}
+    compact = {key: value for key, value in profile.items() if key not in _PROFILE_ROW_COLUMNS}
+    for field in fields:
+        if profile_data.get(field):
+            compact[field] = profile_data[field]
+    return compact
+
+class TokenCounter:
+    """Count tokens with the model's tokenizer, enforce prompt budgets and record usage per call site."""
+
+    MESSAGE_OVERHEAD = 4  # Tokens the chat format adds around each message
+
+    def __init__(self, model: str):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                logger.warning("Tokenizer unavailable, estimating token counts: %s", e)
+        self.usage: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+        )
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is None:
+            return math.ceil(len(text) / 4)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count(message["content"]) + self.MESSAGE_OVERHEAD for message in messages)
+
+    def truncate(self, text: str, budget: int) -> str:
+        """Cut text down to at most budget tokens."""
+        if self.count(text) <= budget:
+            return text
+        if self._encoding is None:
+            return text[:budget * 4]
+        return self._encoding.decode(self._encoding.encode(text, disallowed_special=())[:budget])
+
+    def trim_history(self, messages: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+        """Keep the newest messages that fit in budget, plus a leading summary message if it fits."""
+        summary = messages[:1] if messages and messages[0]["role"] == "system" else []
+        remaining = budget - self.count_messages(summary)
+        if remaining < 0:
+            summary, remaining = [], budget
+
+        kept = []
+        for message in reversed(messages[len(summary):]):
+            cost = self.count(message["content"]) + self.MESSAGE_OVERHEAD
+            if cost > remaining:
+                break
+            kept.append(message)
+            remaining -= cost
+        return summary + kept[::-1]
+
+    def record(self, call_site: str, input_tokens: int, output_tokens: int) -> None:
+        usage = self.usage[call_site]
+        usage["calls"] += 1
+        usage["input_tokens"] += input_tokens
+        usage["output_tokens"] += output_tokens
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {call_site: dict(usage) for call_site, usage in self.usage.items()}
@@ -1,27 +1,34 @@
-from typing import List, Dict, Any
+import asyncio
+import os
+from typing import List, Dict, Any, AsyncIterator
 from .openai_service import OpenAIService
 from .supabase_service import SupabaseService
+from .conversation_sessions import ConversationSessionStore
 
 class UserInteractionService:
     def __init__(self, openai_service: OpenAIService, supabase_service: SupabaseService):
         self.openai_service = openai_service
         self.supabase_service = supabase_service
         self.max_tokens_per_conversation = 2000  # Adjust based on your needs
+        self.sessions = ConversationSessionStore(
+            openai_service,
+            supabase_service,
+            self._should_summarize_conversation,
+            max_sessions=int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000")),
+            flush_every=int(os.getenv("CONVERSATION_FLUSH_MESSAGES", "10"))
+        )
 
     async def process_message(self, message: Dict[str, str]) -> Dict[str, Any]:
         """Process a new message in a conversation."""
-        # Get both users' profiles
-        sender_profile = await self.supabase_service.get_user_profile(message["sender_id"])
-        receiver_profile = await self.supabase_service.get_user_profile(message["receiver_id"])
-
-        # Get conversation history
-        conversation_history = await self.supabase_service.get_conversation_history(
-            message["sender_id"],
-            message["receiver_id"]
+        # Get both users' profiles and the pair's live session
+        sender_profile, receiver_profile, session = await asyncio.gather(
+            self.supabase_service.get_user_profile(message["sender_id"]),
+            self.supabase_service.get_user_profile(message["receiver_id"]),
+            self.sessions.get(message["sender_id"], message["receiver_id"])
         )
 
         # Add the new message to history
-        conversation_history.append({
+        self.sessions.append(session, {
             "role": "user",
             "content": message["content"]
         })
@@ -30,36 +37,61 @@ class UserInteractionService:
         ai_response = await self.openai_service.generate_chat_response(
             sender_profile["profile_data"]["description"],
             receiver_profile["profile_data"]["description"],
-            conversation_history
+            session.context()
         )
 
-        # Add AI response to history
-        conversation_history.append({
+        # Add AI response to history; summarization and persistence happen in the background
+        self.sessions.append(session, {
             "role": "assistant",
             "content": ai_response
         })
 
-        # Check if we should summarize the conversation
-        if self._should_summarize_conversation(conversation_history):
-            summary = await self.openai_service.summarize_conversation(conversation_history)
-            await self.supabase_service.save_conversation(
-                message["sender_id"],
-                message["receiver_id"],
-                conversation_history,
-                summary
-            )
-            # Clear conversation history after saving
-            conversation_history = []
-
         return {
             "response": ai_response,
-            "conversation_history": conversation_history
+            "conversation_history": list(session.messages)
+        }
+
+    async def stream_message(self, message: Dict[str, str]) -> AsyncIterator[Dict[str, Any]]:
+        """Process a new message, yielding response tokens as they are generated."""
+        sender_profile, receiver_profile, session = await asyncio.gather(
+            self.supabase_service.get_user_profile(message["sender_id"]),
+            self.supabase_service.get_user_profile(message["receiver_id"]),
+            self.sessions.get(message["sender_id"], message["receiver_id"])
+        )
+
+        self.sessions.append(session, {
+            "role": "user",
+            "content": message["content"]
+        })
+
+        tokens = []
+        async for token in self.openai_service.stream_chat_response(
+            sender_profile["profile_data"]["description"],
+            receiver_profile["profile_data"]["description"],
+            session.context()
+        ):
+            tokens.append(token)
+            yield {"type": "token", "content": token}
+
+        ai_response = "".join(tokens)
+        summarized = self.sessions.append(session, {
+            "role": "assistant",
+            "content": ai_response
+        })
+
+        yield {
+            "type": "done",
+            "response": ai_response,
+            "conversation_summarized": summarized
         }
 
+    async def drain(self) -> None:
+        """Finish background summarization and persist open conversations."""
+        await self.sessions.drain()
+
     def _should_summarize_conversation(self, conversation_history: List[Dict[str, str]]) -> bool:
         """Determine if the conversation should be summarized based on token count."""
-        # This is a simplified version - in production, you'd want to use a proper tokenizer
-        total_tokens = sum(len(msg["content"].split()) for msg in conversation_history)
+        total_tokens = self.openai_service.tokens.count_messages(conversation_history)
         return total_tokens >= self.max_tokens_per_conversation
 
     async def update_user_description(self, user_id: str, conversation_history: List[Dict[str, str]]) -> None:
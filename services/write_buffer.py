@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from typing import List, Dict, Any, Callable, Awaitable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindBuffer:
+    """Queue rows for one table and insert them as multi-row batches off the request path."""
+
+    def __init__(self,
+                 table: str,
+                 insert: Callable[[str, List[Dict[str, Any]]], Awaitable[Optional[List[Dict[str, Any]]]]],
+                 max_batch_size: int = 100,
+                 flush_interval: float = 1.0,
+                 max_retries: int = 3,
+                 retry_delay: float = 0.5,
+                 on_written: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+        self.table = table
+        self.insert = insert
+        self.on_written = on_written  # Called with the rows insert returned, e.g. with database ids
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval  # Seconds a row may wait before a partial batch is sent
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay  # Initial backoff, doubled on each retry
+        self.dropped = 0  # Rows discarded after exhausting retries
+        self._pending: List[Dict[str, Any]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, row: Dict[str, Any]) -> None:
+        """Queue a row; it is inserted once the batch fills or the flush interval passes."""
+        self._pending.append(row)
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush)
+
+    async def close(self) -> None:
+        """Insert everything still queued and wait for in-flight batches."""
+        self._flush()
+        while self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            task = asyncio.ensure_future(self._write(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                written = await self.insert(self.table, batch)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.dropped += len(batch)
+                    logger.error("Dropping %d %s rows after %d attempts: %s",
+                                 len(batch), self.table, attempt + 1, e)
+                    return
+                logger.warning("Insert into %s failed, retrying in %.1fs: %s", self.table, delay, e)
+                await asyncio.sleep(delay)
+                delay *= 2
+                continue
+            if self.on_written is not None and written:
+                self.on_written(written)
+            return
@@ -0,0 +1,62 @@
+import numpy as np
+from services.candidate_index import CandidateIndex, ANY_INTERACTION_TYPE
+
+GROUPS = ["group-0", "group-1", "group-2", "group-3"]
+TYPES = ["casual", "professional", "dating"]
+
+def _brute_force(reference, group_id, interaction_type):
+    return sorted(
+        user_id for user_id, (groups, types) in reference.items()
+        if (group_id is None or group_id in groups)
+        and (interaction_type is None or interaction_type in types or ANY_INTERACTION_TYPE in types)
+    )
+
+def _members(index, group_id, interaction_type):
+    return sorted(index._user_ids[uid] for uid in index.members(group_id, interaction_type).tolist())
+
+def test_members_match_brute_force_through_interleaved_updates():
+    rng = np.random.default_rng(0)
+    index = CandidateIndex(seed=0)
+    reference = {}
+    for step in range(2000):
+        user_id = f"user-{rng.integers(200)}"
+        if rng.random() < 0.2:
+            index.delete(user_id)
+            reference.pop(user_id, None)
+        else:
+            groups = list(rng.choice(GROUPS, size=rng.integers(0, 3), replace=False))
+            types = list(rng.choice(TYPES, size=rng.integers(0, 3), replace=False))
+            index.upsert_profile(user_id, {"groups": groups, "interaction_types": types})
+            reference[user_id] = (set(groups), set(types) or {ANY_INTERACTION_TYPE})
+
+        # Query part of the time, so some merges see many buffered updates and some only a few
+        if step % 37 == 0:
+            for group_id in [None] + GROUPS:
+                for interaction_type in [None] + TYPES:
+                    members = index.members(group_id, interaction_type)
+                    assert np.all(np.diff(members) > 0)
+                    assert _members(index, group_id, interaction_type)\
+                        == _brute_force(reference, group_id, interaction_type)
+    assert len(index) == len(reference)
+    assert all(user_id in index for user_id in reference)
+
+def test_candidates_sample_within_filters_and_skip_exclusions():
+    rng = np.random.default_rng(1)
+    index = CandidateIndex(seed=1)
+    reference = {}
+    for i in range(300):
+        groups = list(rng.choice(GROUPS, size=2, replace=False))
+        types = list(rng.choice(TYPES, size=rng.integers(0, 2), replace=False))
+        index.upsert(f"user-{i}", groups, types or [ANY_INTERACTION_TYPE])
+        reference[f"user-{i}"] = (set(groups), set(types) or {ANY_INTERACTION_TYPE})
+
+    eligible = _brute_force(reference, "group-1", "casual")
+    excluded = eligible[:10] + ["unknown-user"]
+    everyone = index.candidates("group-1", "casual", exclude_ids=excluded)
+    assert sorted(everyone) == sorted(set(eligible) - set(excluded))
+
+    for limit in (1, 5, 20, len(eligible)):
+        sampled = index.candidates("group-1", "casual", exclude_ids=excluded, limit=limit)
+        assert len(sampled) == min(limit, len(eligible) - 10)
+        assert len(set(sampled)) == len(sampled)
+        assert set(sampled) <= set(everyone)
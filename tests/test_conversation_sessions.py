@@ -0,0 +1,136 @@
+import asyncio
+from services.conversation_sessions import ConversationSessionStore
+
+class FakeSupabase:
+    """Stores conversation rows in insertion order, like the conversations table."""
+
+    def __init__(self):
+        self.rows = []
+
+    async def save_conversation(self, user_id, other_user_id, messages, summary=None):
+        await asyncio.sleep(0)
+        self.rows.append({"pair": {user_id, other_user_id}, "messages": list(messages), "summary": summary})
+
+    async def get_conversation_rows(self, user_id, other_user_id, limit=50):
+        return [row for row in self.rows if row["pair"] == {user_id, other_user_id}][-limit:]
+
+    def stored(self, user_id, other_user_id):
+        return [message for row in self.rows if row["pair"] == {user_id, other_user_id} for message in row["messages"]]
+
+class FakeOpenAI:
+    """Summarizes instantly, or once released when a gate is set."""
+
+    def __init__(self):
+        self.gate = None
+        self.calls = 0
+
+    async def summarize_conversation(self, context):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        return f"summary {self.calls}"
+
+def _store(max_sessions=100, flush_every=3, keep_recent=4, summarize_at=8):
+    supabase, openai = FakeSupabase(), FakeOpenAI()
+    store = ConversationSessionStore(openai, supabase, lambda messages: len(messages) >= summarize_at,
+                                     max_sessions=max_sessions, flush_every=flush_every, keep_recent=keep_recent)
+    return store, supabase, openai
+
+def _message(i):
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"}
+
+def test_every_message_is_persisted_exactly_once():
+    async def run():
+        store, supabase, _ = _store()
+        session = await store.get("a", "b")
+        sent = [_message(i) for i in range(30)]
+        for message in sent:
+            store.append(session, message)
+            await asyncio.sleep(0)
+        await store.drain()
+        assert supabase.stored("a", "b") == sent
+        assert session.persisted == len(sent)
+    asyncio.run(run())
+
+def test_summarizing_keeps_the_most_recent_turns():
+    async def run():
+        store, supabase, _ = _store(flush_every=100)
+        session = await store.get("a", "b")
+        sent = [_message(i) for i in range(8)]
+        for message in sent[:-1]:
+            assert not store.append(session, message)
+        assert store.append(session, sent[-1])
+        await store.drain()
+
+        assert session.summary == "summary 1"
+        assert session.messages == sent[-4:]
+        assert session.offset == 4
+        assert session.context()[0]["role"] == "system"
+        assert supabase.rows[-1]["summary"] == "summary 1"
+        assert supabase.stored("a", "b") == sent
+    asyncio.run(run())
+
+def test_turns_added_during_summarization_stay_in_the_window():
+    async def run():
+        store, supabase, openai = _store()
+        openai.gate = asyncio.Event()
+        session = await store.get("a", "b")
+        sent = [_message(i) for i in range(14)]
+        for message in sent[:8]:
+            store.append(session, message)
+        # The model is still summarizing while the conversation goes on and flushes trigger
+        for message in sent[8:]:
+            store.append(session, message)
+            await asyncio.sleep(0)
+        openai.gate.set()
+        await store.drain()
+
+        assert session.messages == sent[4:]
+        assert supabase.stored("a", "b") == sent
+        restored = store._restore("a", "b", await supabase.get_conversation_rows("a", "b"))
+        assert restored.summary == session.summary
+        assert restored.messages == session.messages
+    asyncio.run(run())
+
+def test_evicted_session_is_restored_from_storage():
+    async def run():
+        store, supabase, _ = _store(max_sessions=1)
+        session = await store.get("a", "b")
+        sent = [_message(i) for i in range(11)]
+        for message in sent:
+            store.append(session, message)
+            await asyncio.sleep(0)
+        await store.drain()
+        await store.get("c", "d")  # Evicts a-b, flushing what it has not stored yet
+        await store.drain()
+
+        restored = await store.get("b", "a")
+        assert restored is not session
+        assert restored.summary == session.summary
+        assert restored.messages == session.messages
+        assert restored.unpersisted == []
+
+        # Continuing the restored conversation stores only the new turns
+        store.append(restored, _message(11))
+        await store.drain()
+        assert supabase.stored("a", "b") == sent + [_message(11)]
+    asyncio.run(run())
+
+def test_session_evicted_while_summarizing_keeps_later_turns():
+    async def run():
+        store, supabase, openai = _store(max_sessions=1, flush_every=100)
+        openai.gate = asyncio.Event()
+        session = await store.get("a", "b")
+        sent = [_message(i) for i in range(10)]
+        for message in sent:
+            store.append(session, message)
+        await store.get("c", "d")  # Evicted while the summary is still being written
+        await asyncio.sleep(0)
+        openai.gate.set()
+        await store.drain()
+
+        assert supabase.stored("a", "b") == sent
+        restored = await store.get("a", "b")
+        assert restored.summary == "summary 1"
+        assert restored.messages == sent[4:]
+    asyncio.run(run())
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from services.embedding_store import EmbeddingStore
+
+# Largest error expected from quantizing a unit vector's components
+TOLERANCE = {"float32": 1e-6, "float16": 1e-3, "int8": 1e-2}
+
+def _random_operations(store, rng, reference=None, steps=400, dimension=16):
+    """Apply random puts and deletes to the store and to a dict, returning the dict."""
+    reference = {} if reference is None else reference
+    for _ in range(steps):
+        item_id = f"user-{rng.integers(60)}"
+        if reference and rng.random() < 0.3:
+            item_id = rng.choice(sorted(reference))
+            store.delete(item_id)
+            del reference[item_id]
+        else:
+            vector = rng.standard_normal(dimension).astype(np.float32)
+            store.put(item_id, vector)
+            reference[item_id] = vector / np.linalg.norm(vector)
+    return reference
+
+def _assert_matches(store, reference, rng):
+    tolerance = TOLERANCE[store.dtype]
+    assert sorted(store.ids) == sorted(reference)
+    assert len(store) == len(reference)
+    for item_id, vector in reference.items():
+        assert store.ids[store.row(item_id)] == item_id
+        np.testing.assert_allclose(store.get(item_id), vector, atol=tolerance)
+
+    query = rng.standard_normal(16).astype(np.float32)
+    query /= np.linalg.norm(query)
+    expected = np.array([reference[item_id] @ query for item_id in store.ids])
+    np.testing.assert_allclose(store.scores(query), expected, atol=4 * tolerance * np.sqrt(16))
+    rows = np.array([store.row(item_id) for item_id in sorted(reference)], dtype=np.int64)
+    np.testing.assert_allclose(store.scores(query, rows), expected[rows], atol=4 * tolerance * np.sqrt(16))
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_in_memory_store_matches_reference(dtype):
+    rng = np.random.default_rng(0)
+    store = EmbeddingStore(dtype=dtype, initial_capacity=4)  # Small capacity so rows are reallocated
+    reference = _random_operations(store, rng)
+    _assert_matches(store, reference, rng)
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_mapped_store_matches_reference_after_reopening(dtype, tmp_path):
+    rng = np.random.default_rng(1)
+    path = str(tmp_path / "store")
+    store = EmbeddingStore(path, dtype=dtype, initial_capacity=4)
+    reference = _random_operations(store, rng)
+    store.metadata["synced_at"] = "2024-01-01T00:00:00+00:00"
+    assert store.changes
+    store.flush()
+    assert store.changes == 0
+
+    reader = EmbeddingStore(path, dtype=dtype, readonly=True)
+    assert reader.metadata == {"synced_at": "2024-01-01T00:00:00+00:00"}
+    _assert_matches(reader, reference, rng)
+
+    # The writer keeps going; the reader sees the new state once it is flushed
+    _random_operations(store, rng, reference, steps=50)
+    store.flush()
+    reader.refresh()
+    _assert_matches(reader, reference, rng)
+
+def test_delete_moves_the_last_row_into_the_freed_slot():
+    store = EmbeddingStore(dtype="int8")
+    vectors = np.eye(4, dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        store.put(f"user-{i}", vector)
+    store.delete("user-1")
+
+    assert store.ids == ["user-0", "user-3", "user-2"]
+    assert store.row("user-3") == 1
+    np.testing.assert_allclose(store.get("user-3"), vectors[3], atol=TOLERANCE["int8"])
+    store.delete("user-2")  # Deleting the last row moves nothing
+    assert store.ids == ["user-0", "user-3"]
+
+def test_only_the_lock_holder_writes(tmp_path):
+    rng = np.random.default_rng(2)
+    path = str(tmp_path / "store")
+    writer = EmbeddingStore(path, dtype="float16")
+    other = EmbeddingStore(path, dtype="float16")  # Same configuration, e.g. a second uvicorn worker
+    assert not writer.readonly
+    assert other.readonly
+    with pytest.raises(PermissionError):
+        other.put("user-0", np.ones(16))
+
+    # The reader starts empty and loads the writer's rows once they are flushed
+    assert len(other) == 0
+    reference = _random_operations(writer, rng, steps=100)
+    other.refresh()
+    assert len(other) == 0
+    writer.flush()
+    other.refresh()
+    _assert_matches(other, reference, rng)
+
+    # The lock is released with the writer, so the next opener writes
+    writer._lock_file.close()
+    assert not EmbeddingStore(path, dtype="float16").readonly
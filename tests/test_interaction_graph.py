@@ -0,0 +1,67 @@
+import numpy as np
+from services.interaction_graph import InteractionGraph
+
+def _random_pairs(rng, count, users=80):
+    return [(f"user-{a}", f"user-{b}") for a, b in rng.integers(users, size=(count, 2)).tolist()]
+
+def _adjacency(pairs):
+    adjacency = {}
+    for a, b in pairs:
+        if a != b:
+            adjacency.setdefault(a, set()).add(b)
+            adjacency.setdefault(b, set()).add(a)
+    return adjacency
+
+def _assert_matches(graph, adjacency, users=80):
+    assert graph.edge_count == sum(map(len, adjacency.values()))
+    for i in range(users):
+        user_id = f"user-{i}"
+        direct = adjacency.get(user_id, set())
+        assert set(graph.neighbors(user_id)) == direct
+        assert graph.degree(user_id) == len(direct)
+        assert all(graph.has_interacted(user_id, other) for other in direct)
+
+        # Two hops away, not user_id and not already a neighbour
+        mutual = {}
+        adamic_adar = {}
+        for neighbour in direct:
+            for candidate in adjacency[neighbour] - direct - {user_id}:
+                mutual[candidate] = mutual.get(candidate, 0) + 1
+                adamic_adar[candidate] = adamic_adar.get(candidate, 0) + 1 / np.log(len(adjacency[neighbour]))
+        user_ids, counts, scores = graph.link_scores(user_id)
+        assert dict(zip(user_ids, counts.tolist())) == mutual
+        np.testing.assert_allclose(scores, [adamic_adar[other] for other in user_ids])
+
+        ranked = graph.friends_of_friends(user_id, limit=5)
+        assert [count for _, count in ranked] == sorted(mutual.values(), reverse=True)[:5]
+
+def test_bulk_load_matches_adjacency_sets():
+    rng = np.random.default_rng(0)
+    pairs = _random_pairs(rng, 400)
+    graph = InteractionGraph()
+    graph.add_edges(pairs)
+    _assert_matches(graph, _adjacency(pairs))
+
+def test_delta_edges_match_before_and_after_compaction():
+    rng = np.random.default_rng(1)
+    bulk, incremental = _random_pairs(rng, 300), _random_pairs(rng, 200)
+    graph = InteractionGraph()
+    graph.add_edges(bulk)
+    for a, b in incremental:
+        graph.add_edge(a, b)
+    # New users and edges are still in the delta sets here
+    adjacency = _adjacency(bulk + incremental)
+    _assert_matches(graph, adjacency)
+    graph.compact()
+    _assert_matches(graph, adjacency)
+    assert np.all(np.diff(graph._indptr) >= 0)
+
+def test_new_users_without_csr_rows():
+    graph = InteractionGraph()
+    graph.add_edges([("a", "b"), ("b", "c")])
+    graph.add_edge("c", "d")  # d has no CSR row until the next compaction
+    assert graph.neighbors("d") == ["c"]
+    assert graph.friends_of_friends("d") == [("b", 1)]
+    assert graph.friends_of_friends("a") == [("c", 1)]
+    assert graph.neighbors("unknown") == []
+    assert not graph.has_interacted("a", "unknown")
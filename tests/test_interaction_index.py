@@ -0,0 +1,97 @@
+import numpy as np
+from services.interaction_index import InteractionIndex
+
+def _interactions(rng, count, dimension=8, start_id=1):
+    return [{
+        "id": start_id + i,
+        "user1_id": f"user-{i % 7}",
+        "user2_id": f"user-{i % 11}",
+        "interaction_type": "casual",
+        "group_id": None,
+        "summary": f"summary {start_id + i}",
+        "embedding": rng.standard_normal(dimension).tolist()
+    } for i in range(count)]
+
+def _brute_force(interactions, query, limit):
+    vectors = np.array([row["embedding"] for row in interactions], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = np.asarray(query, dtype=np.float32) / np.linalg.norm(query)
+    scores = vectors @ query
+    order = np.argsort(-scores)[:limit]
+    return [interactions[i]["id"] for i in order], scores[order]
+
+def _assert_search_matches(index, interactions, rng):
+    for query in rng.standard_normal((20, 8)):
+        ids, scores = _brute_force(interactions, query, 10)
+        hits = index.search(query.tolist(), "casual", limit=10)
+        assert [hit["id"] for hit in hits] == ids
+        np.testing.assert_allclose([hit["similarity_score"] for hit in hits], scores, rtol=1e-5)
+
+def test_trained_partition_matches_brute_force_when_probing_every_list():
+    rng = np.random.default_rng(0)
+    interactions = _interactions(rng, 300)
+    index = InteractionIndex(train_threshold=64, n_probe=1000)
+    for interaction in interactions[:256]:
+        index.add(interaction)
+    assert index.due() == [("casual", None)]
+    index.maintain()
+    assert index.due() == []
+    for interaction in interactions[256:]:
+        index.add(interaction)
+
+    partition = index._partitions[("casual", None)]
+    assert partition.centroids is not None
+    assert partition.packed < partition.size  # Some rows sit in the unpacked tail
+    _assert_search_matches(index, interactions, rng)
+
+def test_rebuild_keeps_rows_added_while_it_runs():
+    rng = np.random.default_rng(3)
+    interactions = _interactions(rng, 400)
+    index = InteractionIndex(train_threshold=64, n_probe=1000)
+    for interaction in interactions[:100]:
+        index.add(interaction)
+    job = index.rebuild(("casual", None))
+    for interaction in interactions[100:]:
+        index.add(interaction)  # Appends to the partition the job is copying from
+    index.swap(("casual", None), job())
+
+    partition = index._partitions[("casual", None)]
+    assert partition.size == 400
+    assert partition.trained_size == 100
+    assert partition.packed == 100
+    _assert_search_matches(index, interactions, rng)
+
+def test_pack_keeps_rows_aligned_and_lists_contiguous():
+    rng = np.random.default_rng(1)
+    interactions = _interactions(rng, 200)
+    index = InteractionIndex(train_threshold=64)
+    for interaction in interactions:
+        index.add(interaction)
+    index.maintain()
+    partition = index._partitions[("casual", None)]
+    assert partition.packed == partition.size
+
+    embeddings = {row["id"]: np.asarray(row["embedding"], dtype=np.float32) for row in interactions}
+    for row, record in enumerate(partition.records):
+        expected = embeddings[record["id"]] / np.linalg.norm(embeddings[record["id"]])
+        np.testing.assert_allclose(partition.vectors[row], expected, rtol=1e-5)
+        assert partition.assignments[row] == np.argmax(partition.centroids @ partition.vectors[row])
+    assert np.all(np.diff(partition.assignments[:partition.size]) >= 0)
+    for cell in range(len(partition.centroids)):
+        assert np.all(partition.assignments[partition.offsets[cell]:partition.offsets[cell + 1]] == cell)
+
+def test_load_restores_indexed_ids_and_skips_them(tmp_path):
+    rng = np.random.default_rng(2)
+    interactions = _interactions(rng, 100)
+    index = InteractionIndex(path=str(tmp_path / "index"), train_threshold=64)
+    for interaction in interactions[50:]:  # A later batch indexed before an earlier one
+        index.add(interaction)
+    index.maintain()
+    index.save()
+
+    loaded = InteractionIndex(path=str(tmp_path / "index"), train_threshold=64)
+    assert loaded.load()
+    assert 75 in loaded and 25 not in loaded
+    for interaction in interactions + _interactions(rng, 5, start_id=101):
+        loaded.add(interaction)
+    assert len(loaded) == 105
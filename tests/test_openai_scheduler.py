@@ -0,0 +1,90 @@
+import asyncio
+import httpx
+import pytest
+from openai import APIConnectionError, APIStatusError, RateLimitError
+from services.openai_scheduler import OpenAIScheduler, TokenBucket
+
+_REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+def _status_error(cls, status, headers=None):
+    return cls("failed", response=httpx.Response(status, headers=headers, request=_REQUEST), body=None)
+
+class FailingCall:
+    """Raises the given errors in turn, then returns how many attempts it took."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.attempts = 0
+
+    async def __call__(self):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.attempts
+
+def test_interactive_requests_overtake_queued_background_work():
+    async def run():
+        scheduler = OpenAIScheduler(requests_per_minute=6000)  # One request every 10ms once drained
+        scheduler.request_bucket.level = 0
+        order = []
+
+        def call(name):
+            async def record():
+                order.append(name)
+            return record
+
+        background = [asyncio.ensure_future(scheduler.submit(call(f"background-{i}"), priority="background"))
+                      for i in range(3)]
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth() == {"interactive": 0, "background": 3}
+        interactive = asyncio.ensure_future(scheduler.submit(call("interactive"), priority="interactive"))
+        await asyncio.gather(*background, interactive)
+        assert order == ["interactive", "background-0", "background-1", "background-2"]
+        assert scheduler.queue_depth() == {"interactive": 0, "background": 0}
+    asyncio.run(run())
+
+def test_token_bucket_waits_for_the_missing_allowance():
+    bucket = TokenBucket(per_minute=600)  # 10 per second
+    assert bucket.wait_time(100) == 0
+    bucket.take(600)
+    assert bucket.wait_time(5) == pytest.approx(0.5, abs=0.01)
+    assert bucket.wait_time(6000) == pytest.approx(60, abs=0.1)  # Oversized requests wait for a full bucket
+
+def test_throttled_and_failed_calls_are_retried():
+    async def run():
+        scheduler = OpenAIScheduler(base_delay=0.001)
+        call = FailingCall(
+            _status_error(RateLimitError, 429),
+            _status_error(APIStatusError, 503),
+            APIConnectionError(request=_REQUEST)
+        )
+        assert await scheduler.submit(call) == 4
+        assert scheduler.retries == {"rate_limit": 1, "server_error": 1, "connection": 1}
+        assert not scheduler.failures
+    asyncio.run(run())
+
+def test_client_errors_are_not_retried():
+    async def run():
+        scheduler = OpenAIScheduler(base_delay=0.001)
+        call = FailingCall(_status_error(APIStatusError, 400))
+        with pytest.raises(APIStatusError):
+            await scheduler.submit(call)
+        assert call.attempts == 1
+        assert not scheduler.retries
+    asyncio.run(run())
+
+def test_retries_give_up_after_max_retries():
+    async def run():
+        scheduler = OpenAIScheduler(max_retries=2, base_delay=0.001)
+        call = FailingCall(*(_status_error(RateLimitError, 429) for _ in range(5)))
+        with pytest.raises(RateLimitError):
+            await scheduler.submit(call)
+        assert call.attempts == 3
+        assert scheduler.retries == {"rate_limit": 2}
+        assert scheduler.failures == {"rate_limit": 1}
+    asyncio.run(run())
+
+def test_backoff_honours_retry_after_and_caps_jitter():
+    scheduler = OpenAIScheduler(base_delay=1.0, max_delay=4.0)
+    assert scheduler._backoff(0, _status_error(RateLimitError, 429, {"retry-after": "7"})) == 7.0
+    assert all(0 <= scheduler._backoff(10, _status_error(RateLimitError, 429)) <= 4.0 for _ in range(50))
@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from services.single_flight import SingleFlight
+
+class Computation:
+    """Counts runs and finishes once released."""
+
+    def __init__(self, result="result", error=None):
+        self.result = result
+        self.error = error
+        self.runs = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.runs += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def test_concurrent_callers_share_one_computation():
+    async def run():
+        flight = SingleFlight()
+        compute, other = Computation("a"), Computation("b")
+        callers = [asyncio.ensure_future(flight.run("key", compute)) for _ in range(5)]
+        other_caller = asyncio.ensure_future(flight.run("other", other))
+        await asyncio.sleep(0)
+        assert len(flight) == 2
+        compute.release.set()
+        other.release.set()
+        assert await asyncio.gather(*callers) == ["a"] * 5
+        assert await other_caller == "b"
+        assert (compute.runs, other.runs) == (1, 1)
+        assert (flight.started, flight.shared) == (2, 4)
+        assert len(flight) == 0
+
+        # Without retention, a later call computes again
+        assert await flight.run("key", compute) == "a"
+        assert compute.runs == 2
+    asyncio.run(run())
+
+def test_errors_reach_every_caller_and_are_not_retained():
+    async def run():
+        flight = SingleFlight(retention=60)
+        failing = Computation(error=RuntimeError("upstream failed"))
+        callers = [asyncio.ensure_future(flight.run("key", failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        failing.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        succeeding = Computation("fresh")
+        succeeding.release.set()
+        assert await flight.run("key", succeeding) == "fresh"
+        assert (failing.runs, succeeding.runs) == (1, 1)
+    asyncio.run(run())
+
+def test_retained_results_are_served_until_forgotten():
+    async def run():
+        flight = SingleFlight(retention=60)
+        compute = Computation("cached")
+        compute.release.set()
+        assert await flight.run("key", compute) == "cached"
+        assert await flight.run("key", compute) == "cached"
+        assert compute.runs == 1
+        assert flight.shared == 1
+
+        flight.forget("key")
+        assert await flight.run("key", compute) == "cached"
+        assert compute.runs == 2
+    asyncio.run(run())
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_computation():
+    async def run():
+        flight = SingleFlight()
+        compute = Computation("done")
+        leaving = asyncio.ensure_future(flight.run("key", compute))
+        staying = asyncio.ensure_future(flight.run("key", compute))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        compute.release.set()
+        assert await staying == "done"
+        assert compute.runs == 1
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+import asyncio
+from services.write_buffer import WriteBehindBuffer
+
+class FlakyTable:
+    """Records inserted batches, failing the first `failures` attempts."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = 0
+        self.batches = []
+
+    async def insert(self, table, rows):
+        self.attempts += 1
+        await asyncio.sleep(0)
+        if self.attempts <= self.failures:
+            raise ConnectionError("upstream unavailable")
+        self.batches.append(list(rows))
+        return [{**row, "id": len(self.batches) * 1000 + i} for i, row in enumerate(rows)]
+
+def _rows(count):
+    return [{"n": i} for i in range(count)]
+
+def test_full_batches_are_sent_without_waiting_for_the_interval():
+    async def run():
+        table = FlakyTable()
+        buffer = WriteBehindBuffer("t", table.insert, max_batch_size=10, flush_interval=60)
+        for row in _rows(25):
+            buffer.add(row)
+        await asyncio.sleep(0.01)
+        assert [len(batch) for batch in table.batches] == [10, 10]
+        assert len(buffer) == 5
+        await buffer.close()
+        assert [row for batch in table.batches for row in batch] == _rows(25)
+    asyncio.run(run())
+
+def test_partial_batch_is_sent_after_the_flush_interval():
+    async def run():
+        table = FlakyTable()
+        buffer = WriteBehindBuffer("t", table.insert, max_batch_size=10, flush_interval=0.02)
+        for row in _rows(3):
+            buffer.add(row)
+        assert table.batches == []
+        await asyncio.sleep(0.05)
+        assert table.batches == [_rows(3)]
+    asyncio.run(run())
+
+def test_failed_inserts_are_retried_then_reported_as_written():
+    async def run():
+        table = FlakyTable(failures=2)
+        written = []
+        buffer = WriteBehindBuffer("t", table.insert, max_batch_size=10, flush_interval=60,
+                                   retry_delay=0.001, on_written=written.extend)
+        for row in _rows(4):
+            buffer.add(row)
+        await buffer.close()
+        assert table.attempts == 3
+        assert table.batches == [_rows(4)]
+        assert [row["id"] for row in written] == [1000, 1001, 1002, 1003]
+        assert buffer.dropped == 0
+    asyncio.run(run())
+
+def test_rows_are_dropped_after_exhausting_retries():
+    async def run():
+        table = FlakyTable(failures=10)
+        written = []
+        buffer = WriteBehindBuffer("t", table.insert, max_batch_size=10, flush_interval=60,
+                                   max_retries=2, retry_delay=0.001, on_written=written.extend)
+        for row in _rows(4):
+            buffer.add(row)
+        await buffer.close()
+        assert table.attempts == 3
+        assert buffer.dropped == 4
+        assert written == []
+    asyncio.run(run())
+
+def test_close_writes_queued_rows_and_waits_for_in_flight_batches():
+    async def run():
+        table = FlakyTable(failures=1)
+        buffer = WriteBehindBuffer("t", table.insert, max_batch_size=2, flush_interval=60, retry_delay=0.01)
+        for row in _rows(5):
+            buffer.add(row)  # Two batches are already in flight, the first one retrying
+        await buffer.close()
+        assert len(buffer) == 0
+        assert sorted(row["n"] for batch in table.batches for row in batch) == list(range(5))
+    asyncio.run(run())